@@ -0,0 +1,46 @@
+''' Sampling throughput of the replay memories, run from the dqns directory '''
+import time
+import numpy as np
+from replay_memory import ReplayMemory, PrioritizedReplayMemory
+
+STATE_SIZE = 12
+
+
+def _fill(memory, rare_every=100, seed=0):
+    ''' Fill memory with random transitions, one in rare_every being a collision '''
+    rng = np.random.default_rng(seed)
+    states = rng.random((memory.capacity, STATE_SIZE), dtype=np.float32)
+    collisions = np.arange(memory.capacity) % rare_every == 0
+    memory.extend(states, np.arange(memory.capacity) % 3,
+                  np.where(collisions, -500, 1), states, collisions)
+
+
+def bench_samples(memory, batch_size=32, batches=2000, seed=0):
+    ''' Samples per second of sample() followed by update_priorities() '''
+    rng = np.random.default_rng(seed)
+    td_errors = rng.random((batches, batch_size))
+    start = time.perf_counter()
+    for batch in range(batches):
+        *_, indices, _ = memory.sample(batch_size)
+        memory.update_priorities(indices, td_errors[batch])
+    return batches * batch_size / (time.perf_counter() - start)
+
+
+def collision_share(memory, batch_size=32, batches=200):
+    ''' Share of sampled transitions being collisions once their TD errors are large '''
+    collisions = np.flatnonzero(memory.dones[:len(memory)])
+    memory.update_priorities(np.arange(len(memory)), np.full(len(memory), 0.1))
+    memory.update_priorities(collisions, np.full(len(collisions), 50.0))
+    sampled = [memory.sample(batch_size)[4].mean() for _ in range(batches)]
+    return float(np.mean(sampled))
+
+
+if __name__ == "__main__":
+    capacity = 1000000
+    print(f"replay memory sampling, capacity {capacity}, batches of 32")
+    for memory in (ReplayMemory(STATE_SIZE, capacity, seed=0),
+                   PrioritizedReplayMemory(STATE_SIZE, capacity, seed=0)):
+        _fill(memory)
+        name = type(memory).__name__
+        print(f"  {name:<26}{bench_samples(memory):12.0f} samples/s"
+              f"{collision_share(memory):8.1%} collisions")
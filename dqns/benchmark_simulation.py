@@ -0,0 +1,85 @@
+''' Timings of the headless simulation, run from the dqns directory '''
+import time
+import numpy as np
+from simulation import polygons_intersect, ray_boxes, random_world, RADARS, VecCarEnv
+
+
+def _timeit(fn, repeat=20):
+    ''' Median wall time of fn() in ms '''
+    fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def _radar_segments(rng, count):
+    origins = rng.uniform(0, 800, (count, 1, 2))
+    radians = rng.uniform(0, 2 * np.pi, (count, 1)) + [offset for offset, _ in RADARS]
+    lengths = np.array([length for _, length in RADARS])
+    ends = origins + np.stack((np.cos(radians), np.sin(radians)), axis=-1) * lengths[:, None]
+    return np.stack((np.broadcast_to(origins, ends.shape), ends), axis=-2)
+
+
+def bench_radars(cars=(1, 64), obstacles=20, seed=0):
+    ''' Radar sensing of every car: SAT per segment, batched SAT and ray casting '''
+    rng = np.random.default_rng(seed)
+    print(f"radar sensing, {len(RADARS)} radars, {obstacles} obstacles")
+    for count in cars:
+        worlds = random_world(rng, obstacles, worlds=count)
+        segments = _radar_segments(rng, count)
+        lower, upper = worlds.min(axis=-2), worlds.max(axis=-2)
+
+        def sat_loop():
+            return [[polygons_intersect(segment, world).any() for segment in car]
+                    for car, world in zip(segments, worlds)]
+
+        def sat_batch():
+            return polygons_intersect(segments, worlds[:, None]).any(axis=-1)
+
+        def rays():
+            return ray_boxes(segments[..., 0, :], segments[..., 1, :] - segments[..., 0, :],
+                             lower[:, None], upper[:, None]).min(axis=-1)
+
+        for name, fn in (('SAT per radar', sat_loop), ('SAT batched', sat_batch),
+                         ('ray casting', rays)):
+            print(f"  {count:>4} cars {name:<16}{_timeit(fn):9.3f} ms")
+
+
+def bench_obstacles(counts=(20, 100, 500, 1000, 5000), cars=64, steps=50, seed=0):
+    '''
+    VecCarEnv steps per second as obstacles grow, at constant obstacle
+    density, testing every obstacle versus the ObstacleGrid
+    '''
+    print(f"simulation steps, {cars} cars, radar distances")
+    for count in counts:
+        side = int(800 * np.sqrt(count / 20))
+        for name, grid in (('all obstacles', False), ('grid', True)):
+            env = VecCarEnv(cars, obstacles=count, radar_distances=True,
+                            world_size=(side, side), seed=seed)
+            if not grid:
+                env._grid = None
+            env.reset()
+            actions = np.random.default_rng(seed).integers(3, size=(steps, cars))
+            start = time.perf_counter()
+            for step in range(steps):
+                env.step(actions[step])
+            rate = steps * cars / (time.perf_counter() - start)
+            print(f"  {count:>5} obstacles {name:<14}{rate:10.0f} steps/s")
+
+
+def bench_resets(counts=(20, 60, 120, 500), cars=64, world_cache=1000, seed=0):
+    ''' Time to reset every game, generating worlds versus drawing them from a cache '''
+    print(f"resets of {cars} games")
+    for count in counts:
+        for name, cache in (('generated', 0), ('cached', world_cache)):
+            env = VecCarEnv(cars, obstacles=count, world_cache=cache, seed=seed)
+            print(f"  {count:>5} obstacles {name:<14}{_timeit(env.reset):9.3f} ms")
+
+
+if __name__ == "__main__":
+    bench_radars()
+    bench_obstacles()
+    bench_resets()
@@ -2,13 +2,14 @@ import os
 import numpy as np
 from math import atan2, sqrt, cos, sin
 import random
-from collections import deque
 import arcade
 import tensorflow as tf
 from tensorflow import keras
 from pathlib import Path
 import matplotlib.pyplot as plt
-import itertools
+from replay_memory import ReplayMemory, PrioritizedReplayMemory
+from numpy_model import NumpyModel
+from frame_stack import FrameStack
 
 SCREEN_WIDTH = 800
 SCREEN_HEIGHT = 800
@@ -196,12 +197,9 @@ class MyGame(arcade.Window):
         self.right_pressed = False
         self.car = Car(terrain=self._world)
         self.cum_reward = 0
-        self.states = deque(maxlen=FRAMES_PER_STATE)
-        # 4 initial state frames
-        self.add_car_state(self.car.get_state())
-        self.add_car_state(self.car.get_state())
-        self.add_car_state(self.car.get_state())
-        self.add_car_state(self.car.get_state())
+        self.states = FrameStack(CAR_STATE_SIZE, FRAMES_PER_STATE)
+        # initial state frames
+        self.states.reset(self.car.get_state())
         self.state, _, _ = self.observe()
 
     def on_draw(self):
@@ -270,8 +268,7 @@ class MyGame(arcade.Window):
         self._steps += 1
 
     def observe(self):
-        state = np.reshape(
-            list(itertools.chain.from_iterable(self.states)), [1, STATE_SIZE])
+        state = self.states.view()
         done = self.car.collides or self._steps == 500
         # reward
         reward = 1
@@ -310,7 +307,7 @@ class MyGame(arcade.Window):
             self.left_pressed = True
 
     def add_car_state(self, state):
-        self.states.append(state)
+        self.states.push(state)
 
     def draw_graphs(self):
         fig, ax = plt.subplots(nrows=2, ncols=2)
@@ -338,16 +335,20 @@ class MyGame(arcade.Window):
 
 
 class DQNAgent():
-    def __init__(self, state_size, action_size):
+    def __init__(self, state_size, action_size, prioritized=False):
+        ''' prioritized: replay transitions by TD error, see PrioritizedReplayMemory '''
         self.state_size = state_size
         self.action_size = action_size
-        self.memory = deque(maxlen=2000)
+        memory = PrioritizedReplayMemory if prioritized else ReplayMemory
+        self.memory = memory(state_size, capacity=2000)
         self.gamma = 0.95  # discount rate
         self.epsilon = 1  # exploration rate
         self.epsilon_min = 0.1
         self.epsilon_decay = 0.995
         self.learning_rate = 0.001
         self.model = self._build_model()
+        # acting without keras predict overhead, synced after every fit
+        self.fast_model = NumpyModel.from_keras(self.model)
 
     def _build_model(self):
         # Neural Net for Deep-Q learning Model
@@ -364,26 +365,31 @@ class DQNAgent():
         return model
 
     def remember(self, state, action, reward, next_state, done):
-        self.memory.append((state, action, reward, next_state, done))
+        self.memory.append(state, action, reward, next_state, done)
 
     def act(self, state):
         if np.random.rand() <= self.epsilon:
             return random.randrange(self.action_size)
 
-        act_values = self.model.predict(state)
+        act_values = self.fast_model.predict(state)
         return np.argmax(act_values[0])  # regturns action
 
     def replay(self, batch_size):
-        minibatch = random.sample(self.memory, batch_size)
-        for state, action, reward, next_state, done in minibatch:
-            target = reward
-            if not done:
-                target = reward + self.gamma * \
-                    np.amax(self.model.predict(next_state)[0])
-            target_f = self.model.predict(state)
-            target_f[0][action] = target
-            history = self.model.fit(state, target_f, epochs=1,
-                                     verbose=0, callbacks=[cp_callback])
+        states, actions, rewards, next_states, dones, indices, weights = \
+            self.memory.sample(batch_size)
+        # one predict for the targets, one for the next state values and one
+        # fit on the whole minibatch instead of three calls per sample
+        target_f = self.model.predict(states)
+        next_values = np.amax(self.model.predict(next_states), axis=1)
+        rows = np.arange(batch_size)
+        targets = rewards + self.gamma * next_values * np.logical_not(dones)
+        # TD errors against the Q values the targets are built from
+        self.memory.update_priorities(indices, targets - target_f[rows, actions])
+        target_f[rows, actions] = targets
+        history = self.model.fit(states, target_f, epochs=1, batch_size=batch_size,
+                                 sample_weight=weights,
+                                 verbose=0, callbacks=[cp_callback])
+        self.fast_model.set_weights(self.model.get_weights())
         if self.epsilon > self.epsilon_min:
             self.epsilon *= self.epsilon_decay
         return history
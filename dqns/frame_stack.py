@@ -0,0 +1,42 @@
+import numpy as np
+
+
+class FrameStack():
+    '''
+    Last `frames` frames of frame_size values of `count` games, oldest first,
+    read as a (count, frames * frame_size) view without copy.
+    Frames are written past the window in a buffer twice as long, the last
+    ones being moved back to its start only once it is full, so a push
+    costs one frame amortized whatever the number of frames, and does not
+    modify the previous view.
+    '''
+
+    def __init__(self, frame_size, frames, count=1, dtype=np.float32):
+        self.frames = frames
+        self._buffer = np.zeros((count, 2 * frames, frame_size), dtype=dtype)
+        self._start = 0
+
+    def reset(self, frame, idx=slice(None)):
+        ''' Fill the windows of games idx with their (len(idx), frame_size) or (frame_size,) frame '''
+        window = slice(self._start, self._start + self.frames)
+        self._buffer[idx, window] = np.expand_dims(frame, -2)
+
+    def push(self, frame):
+        ''' Append the (count, frame_size) or (frame_size,) frame of every game, dropping the oldest '''
+        if self._start == self.frames:
+            # buffer full: move the newest frames back to the start
+            self._buffer[:, :self.frames - 1] = self._buffer[:, self.frames + 1:]
+            self._start = 0
+        else:
+            self._start += 1
+        self._buffer[:, self._start + self.frames - 1] = frame
+
+    def view(self):
+        ''' (count, frames * frame_size) stacked frames, left untouched by the next push '''
+        window = self._buffer[:, self._start:self._start + self.frames]
+        return window.reshape(len(self._buffer), -1)
+
+    def latest(self, count=1):
+        ''' (games, min(count, frames), frame_size) newest frames '''
+        end = self._start + self.frames
+        return self._buffer[:, end - min(count, self.frames):end]
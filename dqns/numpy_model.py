@@ -0,0 +1,61 @@
+import numpy as np
+
+ACTIVATIONS = {
+    'relu': lambda x: np.maximum(x, 0, out=x),
+    'linear': lambda x: x,
+}
+
+
+class NumpyModel():
+    '''
+    Numpy forward pass of a Sequential stack of Dense layers, for acting
+    without the per call overhead of keras predict: a (1, N) state takes a
+    few microseconds. With dueling, the last layer outputs the state value
+    followed by the advantages, combined as value + advantages - their mean.
+    Weights are copies, call set_weights(model.get_weights()) after training.
+    Needs no tensorflow once saved, see save and load.
+    '''
+
+    def __init__(self, weights, activations, dueling=False):
+        self.activations = list(activations)
+        self.dueling = dueling
+        self.set_weights(weights)
+
+    @classmethod
+    def from_keras(cls, model, dueling=False):
+        ''' Copy of a keras model of Dense layers, ending with the dueling Lambda layer if dueling '''
+        layers = model.layers[:-1] if dueling else model.layers
+        activations = [layer.get_config().get('activation') for layer in layers]
+        unsupported = set(activations) - set(ACTIVATIONS)
+        if unsupported:
+            raise ValueError(f"unsupported activations {unsupported}")
+        return cls(model.get_weights(), activations, dueling)
+
+    def set_weights(self, weights):
+        ''' (kernel, bias) of every layer in order, as returned by keras get_weights '''
+        if len(weights) != 2 * len(self.activations):
+            raise ValueError(f"expected {2 * len(self.activations)} arrays, got {len(weights)}")
+        self._layers = [(np.array(kernel, dtype=np.float32), np.array(bias, dtype=np.float32))
+                        for kernel, bias in zip(weights[::2], weights[1::2])]
+
+    def get_weights(self):
+        return [array for layer in self._layers for array in layer]
+
+    def predict(self, states):
+        ''' (K, actions) Q values of (K, N) states '''
+        x = np.asarray(states, dtype=np.float32)
+        for (kernel, bias), activation in zip(self._layers, self.activations):
+            x = ACTIVATIONS[activation](x @ kernel + bias)
+        if self.dueling:
+            advantages = x[:, 1:]
+            x = x[:, :1] + advantages - advantages.mean(axis=1, keepdims=True)
+        return x
+
+    def save(self, path):
+        np.savez(path, *self.get_weights(), activations=self.activations, dueling=self.dueling)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as saved:
+            weights = [saved[f'arr_{idx}'] for idx in range(len(saved.files) - 2)]
+            return cls(weights, saved['activations'].tolist(), bool(saved['dueling']))
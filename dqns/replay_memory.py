@@ -0,0 +1,154 @@
+import numpy as np
+
+
+class ReplayMemory():
+    '''
+    Circular buffer of (state, action, reward, next_state, done) transitions
+    in preallocated arrays, the oldest transition is overwritten once full.
+    Takes capacity * (2 * state_size * 4 + 13) bytes whatever the fill.
+    '''
+
+    def __init__(self, state_size, capacity=2000, seed=None):
+        self.capacity = capacity
+        self.states = np.zeros((capacity, state_size), dtype=np.float32)
+        self.next_states = np.zeros((capacity, state_size), dtype=np.float32)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.dones = np.zeros(capacity, dtype=np.bool_)
+        self._next = 0
+        self._size = 0
+        self._rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return self._size
+
+    def append(self, state, action, reward, next_state, done):
+        ''' Store a transition, states may be (state_size,) or (1, state_size) arrays '''
+        idx = self._next
+        self.states[idx] = np.ravel(state)
+        self.next_states[idx] = np.ravel(next_state)
+        self.actions[idx] = action
+        self.rewards[idx] = reward
+        self.dones[idx] = done
+        self._next = (idx + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+        return idx
+
+    def extend(self, states, actions, rewards, next_states, dones):
+        ''' Store a batch of transitions at once, returns their indices '''
+        count = len(actions)
+        idx = (self._next + np.arange(count)) % self.capacity
+        self.states[idx] = np.reshape(states, (count, -1))
+        self.next_states[idx] = np.reshape(next_states, (count, -1))
+        self.actions[idx] = actions
+        self.rewards[idx] = rewards
+        self.dones[idx] = dones
+        self._next = (self._next + count) % self.capacity
+        self._size = min(self._size + count, self.capacity)
+        return idx
+
+    def sample(self, batch_size):
+        '''
+        (states, actions, rewards, next_states, dones, indices, weights) of
+        batch_size distinct random transitions, weights are all 1
+        '''
+        idx = self._rng.choice(self._size, batch_size, replace=False)
+        return (self.states[idx], self.actions[idx], self.rewards[idx],
+                self.next_states[idx], self.dones[idx],
+                idx, np.ones(batch_size, dtype=np.float32))
+
+    def update_priorities(self, indices, td_errors):
+        ''' Uniform sampling ignores TD errors, see PrioritizedReplayMemory '''
+        pass
+
+
+class SumTree():
+    '''
+    Binary tree of non negative priorities where every node holds the sum of
+    its children, the root being the total. Updates and prefix sum searches
+    walk one root to leaf path, O(log n), and are vectorized over batches.
+    '''
+
+    def __init__(self, capacity):
+        self._leaves = 1 << max(capacity - 1, 0).bit_length()
+        # 1 based heap layout: children of node i are 2i and 2i + 1
+        self._tree = np.zeros(2 * self._leaves, dtype=np.float64)
+        self._depth = self._leaves.bit_length() - 1
+
+    @property
+    def total(self):
+        return self._tree[1]
+
+    def get(self, indices):
+        return self._tree[self._leaves + np.asarray(indices)]
+
+    def update(self, indices, priorities):
+        ''' Set the priorities of leaves `indices`, the last one wins on duplicates '''
+        nodes = self._leaves + np.asarray(indices)
+        self._tree[nodes] = priorities
+        for _ in range(self._depth):
+            nodes = np.unique(nodes // 2)
+            self._tree[nodes] = self._tree[2 * nodes] + self._tree[2 * nodes + 1]
+
+    def find(self, values):
+        ''' Leaf indices where the prefix sums of priorities reach values '''
+        nodes = np.ones(len(values), dtype=np.int64)
+        values = np.array(values, dtype=np.float64)
+        for _ in range(self._depth):
+            left = self._tree[2 * nodes]
+            right = values > left
+            values -= left * right
+            nodes = 2 * nodes + right
+        return nodes - self._leaves
+
+
+class PrioritizedReplayMemory(ReplayMemory):
+    '''
+    ReplayMemory sampling transitions with probability priority ** alpha,
+    where priority is the last absolute TD error, see update_priorities.
+    New transitions get the highest priority seen so they are replayed at
+    least once. Importance sampling weights correct the bias, beta is
+    annealed to 1 by beta_increment on every sample.
+    '''
+
+    def __init__(self, state_size, capacity=2000, alpha=0.6, beta=0.4,
+                 beta_increment=0.001, epsilon=0.01, seed=None):
+        super(PrioritizedReplayMemory, self).__init__(state_size, capacity, seed)
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_increment = beta_increment
+        self.epsilon = epsilon
+        self._priorities = SumTree(capacity)
+        self._max_priority = 1.0
+
+    def append(self, state, action, reward, next_state, done):
+        idx = super(PrioritizedReplayMemory, self).append(state, action, reward, next_state, done)
+        self._priorities.update([idx], [self._max_priority])
+        return idx
+
+    def extend(self, states, actions, rewards, next_states, dones):
+        idx = super(PrioritizedReplayMemory, self).extend(states, actions, rewards, next_states, dones)
+        self._priorities.update(idx, np.full(len(idx), self._max_priority))
+        return idx
+
+    def sample(self, batch_size):
+        '''
+        (states, actions, rewards, next_states, dones, indices, weights) of
+        batch_size transitions drawn one per equal priority mass segment
+        '''
+        segment = self._priorities.total / batch_size
+        values = (np.arange(batch_size) + self._rng.random(batch_size)) * segment
+        # rounding may walk past the last stored transition
+        idx = np.minimum(self._priorities.find(values), self._size - 1)
+        probabilities = self._priorities.get(idx) / self._priorities.total
+        weights = (self._size * probabilities) ** -self.beta
+        weights /= weights.max()
+        self.beta = min(1.0, self.beta + self.beta_increment)
+        return (self.states[idx], self.actions[idx], self.rewards[idx],
+                self.next_states[idx], self.dones[idx],
+                idx, weights.astype(np.float32))
+
+    def update_priorities(self, indices, td_errors):
+        priorities = (np.abs(td_errors) + self.epsilon) ** self.alpha
+        self._priorities.update(indices, priorities)
+        self._max_priority = max(self._max_priority, float(priorities.max()))
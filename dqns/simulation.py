@@ -0,0 +1,400 @@
+'''
+Headless simulation of the random_world game: a car driving at constant speed
+among random square obstacles, sensing them with line radars. Pure numpy, no
+window nor sprite, so it runs as fast as the CPU allows, see viewer.py to
+watch it.
+'''
+import numpy as np
+from frame_stack import FrameStack
+
+SCREEN_WIDTH = 800
+SCREEN_HEIGHT = 800
+# (radians offset to the car heading, length) of each radar
+RADARS = ((0.7, 40), (0.4, 60), (0, 80), (-0.4, 60), (-0.7, 40))
+# radar bips and whether the car is turning
+CAR_STATE_SIZE = len(RADARS) + 1
+ACTION_SIZE = 3
+
+
+def _normals(polygons):
+    ''' (..., K, 2) edge normals of (..., K, 2) polygons, the separating axes to test '''
+    edges = np.roll(polygons, -1, axis=-2) - polygons
+    return np.stack((edges[..., 1], -edges[..., 0]), axis=-1)
+
+
+def _separated(own, other):
+    ''' Whether projections (..., P, A) and (..., Q, A) are apart or touching on any of the A axes '''
+    return ((own.max(axis=-2) <= other.min(axis=-2)) |
+            (other.max(axis=-2) <= own.min(axis=-2))).any(axis=-1)
+
+
+def polygons_intersect(polygon, polygons):
+    '''
+    Whether convex polygons (..., P, 2), or segments (..., 2, 2), intersect
+    each of the convex polygons (..., M, Q, 2), returns (..., M). Leading
+    dimensions broadcast. Uses the separating axis theorem like
+    arcade.are_polygons_intersecting: touching does not count as intersecting.
+    '''
+    polygon = np.asarray(polygon, dtype=np.float64)[..., None, :, :]
+    polygons = np.asarray(polygons, dtype=np.float64)
+    separated = False
+    for axes in (_normals(polygon), _normals(polygons)):
+        axes = axes[..., None, :, :]
+        own = (polygon[..., :, None, 0] * axes[..., 0] +
+               polygon[..., :, None, 1] * axes[..., 1])
+        other = (polygons[..., :, None, 0] * axes[..., 0] +
+                 polygons[..., :, None, 1] * axes[..., 1])
+        separated = separated | _separated(own, other)
+    return ~separated
+
+
+def ray_boxes(origins, vectors, lower, upper):
+    '''
+    Where segments origin + t * vector, t in [0, 1), first enter the inside
+    of axis aligned boxes (lower, upper): (..., 2) origins and vectors
+    against (..., M, 2) corners give (..., M) values of t, 0 when starting
+    inside a box and inf when missing it or only touching it, like
+    polygons_intersect. Leading dimensions broadcast.
+    '''
+    origins = np.asarray(origins, dtype=np.float64)[..., None, :]
+    vectors = np.asarray(vectors, dtype=np.float64)[..., None, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        near = (lower - origins) / vectors
+        far = (upper - origins) / vectors
+    # segments parallel to a side are within that slab all along or never
+    parallel = vectors == 0
+    inside = (lower < origins) & (origins < upper)
+    enter = np.where(parallel, np.where(inside, -np.inf, np.inf), np.minimum(near, far)).max(axis=-1)
+    leave = np.where(parallel, np.where(inside, np.inf, -np.inf), np.maximum(near, far)).min(axis=-1)
+    hits = (enter < leave) & (leave > 0) & (enter < 1)
+    return np.where(hits, np.maximum(enter, 0), np.inf)
+
+
+def random_world(rng, count=20, size=70, margin=100, worlds=None,
+                 world_size=(SCREEN_WIDTH, SCREEN_HEIGHT)):
+    ''' (count, 4, 2) square obstacles at random positions away from the world sides, (worlds, count, 4, 2) if worlds '''
+    shape = (count,) if worlds is None else (worlds, count)
+    width, height = world_size
+    x = rng.integers(margin, width - margin - size, endpoint=True, size=shape)
+    y = rng.integers(margin, height - margin - size, endpoint=True, size=shape)
+    corners = np.array([(0, 0), (size, 0), (size, size), (0, size)])
+    return np.stack((x, y), axis=-1)[..., None, :] + corners
+
+
+class ObstacleGrid():
+    '''
+    Uniform grid index over the axis aligned obstacles of `count` worlds.
+    Every cell lists the obstacles overlapping it, padded with -1 to the
+    fullest cell, so the obstacles near points of every world are gathered
+    with one indexing of the 3x3 cells around them. Anything within
+    cell_size of a point is in those cells.
+    '''
+
+    def __init__(self, count, world_size, cell_size):
+        self.cell_size = cell_size
+        self.shape = tuple(int(np.ceil(side / cell_size)) for side in world_size)
+        self.cells = np.full((count, self.shape[0] * self.shape[1], 0), -1, dtype=np.int64)
+
+    def _cell(self, points):
+        return np.clip((points // self.cell_size).astype(np.int64), 0, np.array(self.shape) - 1)
+
+    def update(self, idx, lower, upper):
+        ''' Index the (len(idx), M, 2) obstacle bounds of worlds idx '''
+        first, last = self._cell(lower), self._cell(upper)
+        span = (last - first).max(axis=(0, 1)) + 1
+        worlds, cells, obstacles = [], [], []
+        # every cell of each obstacle bounds, one offset at a time
+        for dx in range(span[0]):
+            for dy in range(span[1]):
+                cell = first + (dx, dy)
+                world, obstacle = np.nonzero((cell <= last).all(axis=-1))
+                worlds.append(world)
+                cells.append(cell[world, obstacle, 0] * self.shape[1] + cell[world, obstacle, 1])
+                obstacles.append(obstacle)
+        worlds, cells, obstacles = map(np.concatenate, (worlds, cells, obstacles))
+        keys = worlds * self.cells.shape[1] + cells
+        order = np.argsort(keys, kind='stable')
+        keys, worlds, cells, obstacles = keys[order], worlds[order], cells[order], obstacles[order]
+        # rank of each obstacle within its cell
+        slots = np.arange(len(keys)) - np.searchsorted(keys, keys)
+        width = int(slots.max()) + 1 if len(slots) else 0
+        if width > self.cells.shape[2]:
+            pad = width - self.cells.shape[2]
+            self.cells = np.pad(self.cells, ((0, 0), (0, 0), (0, pad)), constant_values=-1)
+        self.cells[idx] = -1
+        self.cells[np.asarray(idx)[worlds], cells, slots] = obstacles
+
+    def nearby(self, points, idx=slice(None)):
+        ''' (len(idx), 9 * cell width) obstacles in the cells around a point of each world idx, -1 padded '''
+        cell = self._cell(points)[:, None, :] + np.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+        cell = np.clip(cell, 0, np.array(self.shape) - 1)
+        cells = cell[..., 0] * self.shape[1] + cell[..., 1]
+        worlds = np.arange(self.cells.shape[0])[idx]
+        return self.cells[worlds[:, None], cells].reshape(len(worlds), -1)
+
+
+class VecCarEnv():
+    '''
+    `count` independent games of random_world stepped at once, every car
+    and world being rows of numpy arrays.
+    Actions: 0 straight, 1 right, 2 left. States are the last
+    frames_per_state car states, (radar bips..., turning), flattened into
+    (count, frames_per_state * CAR_STATE_SIZE) arrays. Reward is 3 minus one
+    per frame spent turning, -50 on collision, which ends the episode as does
+    reaching max_steps.
+    With radar_distances, radars read the distance to the nearest obstacle
+    over their length, 1 when nothing is in range, like real distance
+    sensors, instead of bips.
+    Worlds of GRID_MIN_OBSTACLES obstacles or more are indexed by an
+    ObstacleGrid so that sensing only looks at the obstacles around cars.
+    Resets draw from world_cache pregenerated worlds when given, new ones
+    otherwise, see generate_worlds.
+    '''
+    SPEED = 5
+    STEER = 0.2
+    # car.png scaled by 0.25, heading along its length
+    CAR_LENGTH = 25
+    CAR_WIDTH = 12.5
+    # below that, testing every obstacle is cheaper than gathering the nearby ones
+    GRID_MIN_OBSTACLES = 64
+
+    def __init__(self, count=8, obstacles=20, frames_per_state=2, max_steps=750,
+                 radar_distances=False, world_size=(SCREEN_WIDTH, SCREEN_HEIGHT),
+                 world_cache=0, seed=None):
+        self.count = count
+        self.radar_distances = radar_distances
+        self.obstacle_count = obstacles
+        self.frames_per_state = frames_per_state
+        self.state_size = frames_per_state * CAR_STATE_SIZE
+        self.action_size = ACTION_SIZE
+        self.max_steps = max_steps
+        self.world_size = world_size
+        self._rng = np.random.default_rng(seed)
+        self._radar_offsets = np.array([offset for offset, _ in RADARS])
+        self._radar_lengths = np.array([length for _, length in RADARS])
+        self.x = np.full(count, world_size[0] / 2)
+        self.y = np.full(count, world_size[1] / 2)
+        self.radians = np.zeros(count)
+        self.turning = np.zeros(count, dtype=np.int64)
+        self.steps = np.zeros(count, dtype=np.int64)
+        self.distance = np.zeros(count)
+        self.obstacles = np.zeros((count, obstacles, 4, 2))
+        # axis aligned bounds of the obstacles, the extra last one is a point
+        # out of reach for the grid padding
+        self._lower = np.full((count, obstacles + 1, 2), -1e6)
+        self._upper = np.full((count, obstacles + 1, 2), -1e6)
+        self._grid = None
+        if obstacles >= self.GRID_MIN_OBSTACLES:
+            reach = max(max(self._radar_lengths), np.hypot(self.CAR_LENGTH, self.CAR_WIDTH) / 2)
+            self._grid = ObstacleGrid(count, world_size, reach)
+        self.bips = np.zeros((count, len(RADARS)), dtype=bool)
+        self.distances = np.zeros((count, len(RADARS)))
+        self.collides = np.zeros(count, dtype=bool)
+        self._frames = FrameStack(CAR_STATE_SIZE, frames_per_state, count)
+        self._cache = self.generate_worlds(world_cache) if world_cache else None
+
+    def reset(self, mask=None):
+        ''' Start new episodes in new worlds for the games in mask, all by default, returns the states '''
+        idx = np.arange(self.count) if mask is None else np.flatnonzero(mask)
+        self.x[idx] = self.world_size[0] / 2
+        self.y[idx] = self.world_size[1] / 2
+        if self._cache is None:
+            self.radians[idx], self.obstacles[idx] = self.generate_worlds(len(idx))
+        else:
+            picks = self._rng.integers(len(self._cache[0]), size=len(idx))
+            self.radians[idx], self.obstacles[idx] = self._cache[0][picks], self._cache[1][picks]
+        self.turning[idx] = 0
+        self.steps[idx] = 0
+        self.distance[idx] = 0
+        self._lower[idx, :-1] = self.obstacles[idx, :, 0]
+        self._upper[idx, :-1] = self.obstacles[idx, :, 2]
+        if self._grid is not None:
+            self._grid.update(idx, self._lower[idx, :-1], self._upper[idx, :-1])
+        # worlds are clear around the car
+        self.bips[idx] = False
+        self.distances[idx] = self._radar_lengths
+        self.collides[idx] = False
+        self._frames.reset(self._car_states(idx), idx)
+        return self.states()
+
+    def generate_worlds(self, count):
+        '''
+        (radians, obstacles) of count starting headings and worlds where the
+        car does not collide nor detect anything at start. Obstacles are
+        independent, so instead of redrawing whole worlds until one is
+        clear, candidates are drawn in bulk and the ones within reach of
+        the car or its radars are dropped, which gives the same worlds.
+        '''
+        radians = self._rng.random(count) * 3.14
+        obstacles = np.zeros((count, self.obstacle_count, 4, 2))
+        found = np.zeros(count, dtype=np.int64)
+        heading = np.stack((np.cos(radians), np.sin(radians)), axis=-1)
+        side = np.stack((-heading[:, 1], heading[:, 0]), axis=-1)
+        half_length = heading * self.CAR_LENGTH / 2
+        half_width = side * self.CAR_WIDTH / 2
+        car = np.array(self.world_size) / 2 + np.stack((
+            -half_length - half_width, half_length - half_width,
+            half_length + half_width, -half_length + half_width), axis=1)
+        radars = radians[:, None] + self._radar_offsets
+        radars = np.stack((np.cos(radars), np.sin(radars)), axis=-1) * self._radar_lengths[:, None]
+        pending = np.arange(count)
+        while len(pending):
+            # a few more than missing, most candidates are clear
+            missing = self.obstacle_count - found[pending]
+            candidates = random_world(self._rng, int(missing.max() * 1.25) + 8, worlds=len(pending),
+                                      world_size=self.world_size)
+            lower, upper = candidates[:, None, :, 0], candidates[:, None, :, 2]
+            hits = ray_boxes(np.array(self.world_size) / 2, radars[pending], lower, upper) <= 1
+            clear = ~(hits.any(axis=1) | polygons_intersect(car[pending], candidates))
+            # keep the first missing clear candidates of each world
+            rank = np.cumsum(clear, axis=1) - 1
+            worlds, slots = np.nonzero(clear & (rank < missing[:, None]))
+            obstacles[pending[worlds], found[pending][worlds] + rank[worlds, slots]] = candidates[worlds, slots]
+            found[pending] += np.minimum(clear.sum(axis=1), missing)
+            pending = pending[found[pending] < self.obstacle_count]
+        return radians, obstacles
+
+    def step(self, actions):
+        '''
+        Apply one action per game, returns (states, rewards, dones, info).
+        Finished games start over, their states are the first ones of the
+        new episode while info['final_states'] holds the last ones.
+        '''
+        states, rewards, dones = self._advance(actions)
+        # index of the step just played, the score random_world logged
+        info = {'final_states': states, 'steps': self.steps - 1,
+                'distance': self.distance.copy()}
+        if dones.any():
+            # resets overwrite the states in place
+            info['final_states'] = states.copy()
+            states = self.reset(dones)
+        return states, rewards, dones, info
+
+    def _advance(self, actions):
+        # 1 right, 2 left
+        self.turning = np.choose(np.asarray(actions), [0, -1, 1])
+        self.radians += self.turning * self.STEER
+        self.x += self.SPEED * np.cos(self.radians)
+        self.y += self.SPEED * np.sin(self.radians)
+        # cross the screen sides to the other one
+        width, height = self.world_size
+        self.x[self.x < 0] = width
+        self.x[self.x > width] = 0
+        self.y[self.y < 0] = height
+        self.y[self.y > height] = 0
+        self.distance += self.SPEED
+        self._sense()
+        self._frames.push(self._car_states())
+
+        rewards = np.where(self.collides, -50, 3 - self._frames.latest(2)[..., -1].sum(axis=1))
+        dones = self.collides | (self.steps == self.max_steps)
+        self.steps += 1
+        return self.states(), rewards, dones
+
+    def states(self):
+        '''
+        (count, state_size) view of the states. The next step leaves it
+        untouched except for the games it restarts, copy it to keep those.
+        '''
+        return self._frames.view()
+
+    def car_polygons(self, idx=slice(None)):
+        ''' (count, 4, 2) corners of the cars '''
+        heading = np.stack((np.cos(self.radians[idx]), np.sin(self.radians[idx])), axis=-1)
+        side = np.stack((-heading[:, 1], heading[:, 0]), axis=-1)
+        half_length = heading * self.CAR_LENGTH / 2
+        half_width = side * self.CAR_WIDTH / 2
+        center = np.stack((self.x[idx], self.y[idx]), axis=-1)
+        corners = np.stack((-half_length - half_width, half_length - half_width,
+                            half_length + half_width, -half_length + half_width), axis=1)
+        return center[:, None, :] + corners
+
+    def radar_segments(self, idx=slice(None)):
+        ''' (count, R, 2, 2) start and end points of the radars '''
+        radians = self.radians[idx, None] + self._radar_offsets
+        x, y = self.x[idx, None], self.y[idx, None]
+        ends = np.stack((x + np.cos(radians) * self._radar_lengths,
+                         y + np.sin(radians) * self._radar_lengths), axis=-1)
+        starts = np.broadcast_to(np.stack((x, y), axis=-1), ends.shape)
+        return np.stack((starts, ends), axis=-2)
+
+    def _sense(self, idx=slice(None)):
+        lower, upper = self._lower[idx], self._upper[idx]
+        if self._grid is None:
+            lower, upper = lower[:, :-1], upper[:, :-1]
+        else:
+            # -1 padding picks the out of reach point
+            nearby = self._grid.nearby(np.stack((self.x[idx], self.y[idx]), axis=-1), idx)
+            lower = np.take_along_axis(lower, nearby[..., None], axis=1)
+            upper = np.take_along_axis(upper, nearby[..., None], axis=1)
+        segments = self.radar_segments(idx)
+        # obstacles are axis aligned, radars are cast as rays against their bounds
+        nearest = ray_boxes(segments[..., 0, :], segments[..., 1, :] - segments[..., 0, :],
+                            lower[:, None], upper[:, None]).min(axis=-1)
+        self.bips[idx] = nearest <= 1
+        self.distances[idx] = np.minimum(nearest, 1) * self._radar_lengths
+        boxes = np.stack((lower, np.stack((upper[..., 0], lower[..., 1]), axis=-1),
+                          upper, np.stack((lower[..., 0], upper[..., 1]), axis=-1)), axis=-2)
+        self.collides[idx] = polygons_intersect(self.car_polygons(idx), boxes).any(axis=-1)
+
+    def _car_states(self, idx=slice(None)):
+        radars = self.distances[idx] / self._radar_lengths if self.radar_distances else self.bips[idx]
+        return np.concatenate((radars, self.turning[idx, None] != 0), axis=1)
+
+
+class CarEnv():
+    '''
+    Gym style single game of random_world, see VecCarEnv.
+    States are (1, frames_per_state * CAR_STATE_SIZE) arrays owned by the
+    caller, unlike the VecCarEnv views, and, as with gym, the caller resets
+    the game once done.
+    '''
+
+    def __init__(self, obstacles=20, frames_per_state=2, max_steps=750,
+                 radar_distances=False, world_size=(SCREEN_WIDTH, SCREEN_HEIGHT),
+                 world_cache=0, seed=None):
+        self._env = VecCarEnv(1, obstacles, frames_per_state, max_steps, radar_distances,
+                              world_size, world_cache, seed)
+        self.state_size = self._env.state_size
+        self.action_size = self._env.action_size
+
+    def reset(self):
+        ''' Start a new episode in a new world, returns the first state '''
+        return self._env.reset().copy()
+
+    def step(self, action):
+        ''' Apply action, returns (state, reward, done, info) '''
+        states, rewards, dones = self._env._advance([action])
+        return states.copy(), int(rewards[0]), bool(dones[0]), {'distance': self.distance}
+
+    @property
+    def steps(self):
+        return int(self._env.steps[0])
+
+    @property
+    def distance(self):
+        return float(self._env.distance[0])
+
+    @property
+    def obstacles(self):
+        return self._env.obstacles[0]
+
+    @property
+    def bips(self):
+        return self._env.bips[0]
+
+    @property
+    def distances(self):
+        return self._env.distances[0]
+
+    @property
+    def collides(self):
+        return bool(self._env.collides[0])
+
+    def car_polygon(self):
+        ''' (4, 2) corners of the car '''
+        return self._env.car_polygons()[0]
+
+    def radar_segments(self):
+        ''' (R, 2, 2) start and end points of the radars '''
+        return self._env.radar_segments()[0]
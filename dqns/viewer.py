@@ -0,0 +1,98 @@
+'''
+arcade window drawing the first game of a training session, see simulation.py.
+Keys: G graphs, SPACE pause, D draw, R restart.
+'''
+import arcade
+import matplotlib.pyplot as plt
+import numpy as np
+from simulation import SCREEN_WIDTH, SCREEN_HEIGHT, RADARS
+
+
+class Viewer(arcade.Window):
+
+    def __init__(self, session, title):
+        super().__init__(SCREEN_WIDTH, SCREEN_HEIGHT,
+                         f"Drive.ai - {title} - G: graphs, SPACE: pause, D: draw, R: restart")
+        arcade.set_background_color(arcade.color.AMAZON)
+        self.session = session
+        self.title = title
+        self.restart = False
+        self.draw = True
+        self.graphs = False
+        self.pause = False
+
+    def on_draw(self):
+        """ Render the screen. """
+        arcade.start_render()  # Clear screen
+        if not self.draw:
+            return
+
+        # first game of the session
+        env = self.session.env
+        for obstacle in env.obstacles[0]:
+            arcade.draw_polygon_filled(obstacle.tolist(), arcade.color.BLUE)
+        arcade.draw_polygon_filled(env.car_polygons()[0].tolist(), arcade.color.WHITE)
+        for (start, end), bip, distance, (_, length) in zip(
+                env.radar_segments()[0], env.bips[0], env.distances[0], RADARS):
+            color = arcade.color.RED if bip else arcade.color.BLUE
+            # up to the nearest obstacle
+            end = start + (end - start) * distance / length
+            arcade.draw_line(*start, *end, color)
+        arcade.draw_text(f'{self.title}', 10,
+                         SCREEN_HEIGHT-25, arcade.color.WHITE)
+        arcade.draw_text(f'game {self.session.games}', 10,
+                         SCREEN_HEIGHT-50, arcade.color.WHITE)
+        arcade.draw_text(f'step {env.steps[0]}', 10,
+                         SCREEN_HEIGHT-75, arcade.color.WHITE)
+        arcade.draw_text(f'reward {self.session.cum_rewards[0]}',
+                         10, SCREEN_HEIGHT-100, arcade.color.WHITE)
+
+    def update(self, delta_time):
+        """ One simulation and training step per frame """
+        if self.restart:
+            self.restart = False
+            self.session.reset()
+
+        if self.pause:
+            return
+
+        if self.graphs:
+            self.draw_graphs()
+
+        self.session.step()
+
+    def on_key_press(self, key, modifiers):
+        """Called whenever a key is pressed. """
+        if key == arcade.key.D:
+            self.draw = not self.draw
+        if key == arcade.key.R:
+            self.restart = True
+        if key == arcade.key.G:
+            self.graphs = not self.graphs
+        if key == arcade.key.SPACE:
+            self.pause = not self.pause
+
+    def draw_graphs(self):
+        history = self.session.history
+        fig, ax = plt.subplots(nrows=2, ncols=2)
+        ax[0, 0].plot(history['score'], label='score')
+        ax[0, 0].legend(loc="upper right")
+
+        ax[0, 1].plot(history['epsilons'], label='epsilons')
+        ax[0, 1].legend(loc="upper right")
+
+        ax[1, 0].plot(history['rewards'], label='rewards')
+        ax[1, 0].legend(loc="upper right")
+
+        ax[1, 1].plot(history['score'], '-', label='score')
+        mva9 = np.convolve(history['score'], np.ones(9)/9)
+        ax[1, 1].plot(mva9, label='mva 9')
+        mva50 = np.convolve(history['score'], np.ones(50)/50)
+        ax[1, 1].plot(mva50, label='mva 50')
+        mva100 = np.convolve(history['score'], np.ones(100)/100)
+        ax[1, 1].plot(mva100, label='mva 100')
+        ax[1, 1].legend(loc="upper right")
+
+        plt.legend()
+        plt.show()
+        self.graphs = False
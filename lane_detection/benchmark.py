@@ -0,0 +1,187 @@
+''' Per-stage timings of the lane detection pipeline, run from the repository root '''
+import glob
+import os
+import tempfile
+import time
+from collections import deque
+import cv2
+import numpy as np
+from run import _average_lines, LaneSmoother, convert_hls, gray_scale, white_yellow, interest_region, video_frames, LaneDetector, WhiteYellowMask, WHITE_LOWER, WHITE_UPPER, YELLOW_LOWER, YELLOW_UPPER
+
+IMAGES_DIR = os.path.join('lane_detection', 'images')
+VIDEOS_DIR = os.path.join('lane_detection', 'videos', 'input')
+
+
+def _timeit(fn, repeat=50):
+    ''' Median wall time of fn() in ms '''
+    fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def _report(title, stages, total=True):
+    print(title)
+    for name, ms in stages:
+        print(f"  {name:<24}{ms:8.3f} ms")
+    if total:
+        print(f"  {'sum':<24}{sum(ms for _, ms in stages):8.3f} ms")
+
+
+def bench_white_yellow(img):
+    ''' white_yellow + gray_scale chain against the reused-buffer WhiteYellowMask '''
+    hls = convert_hls(img)
+    white = cv2.inRange(hls, WHITE_LOWER, WHITE_UPPER)
+    yellow = cv2.inRange(hls, YELLOW_LOWER, YELLOW_UPPER)
+    mask = cv2.bitwise_or(white, yellow)
+    masked = cv2.bitwise_and(img, img, mask=mask)
+    _report(f"white_yellow + gray_scale {img.shape[1]}x{img.shape[0]}", [
+        ('convert_hls', _timeit(lambda: convert_hls(img))),
+        ('inRange white', _timeit(lambda: cv2.inRange(hls, WHITE_LOWER, WHITE_UPPER))),
+        ('inRange yellow', _timeit(lambda: cv2.inRange(hls, YELLOW_LOWER, YELLOW_UPPER))),
+        ('bitwise_or', _timeit(lambda: cv2.bitwise_or(white, yellow))),
+        ('bitwise_and', _timeit(lambda: cv2.bitwise_and(img, img, mask=mask))),
+        ('gray_scale', _timeit(lambda: gray_scale(masked))),
+    ])
+
+    white_yellow_mask = WhiteYellowMask()
+    _report("chain against WhiteYellowMask", [
+        ('white_yellow', _timeit(lambda: white_yellow(img))),
+        ('WhiteYellowMask', _timeit(lambda: white_yellow_mask(img))),
+        ('+ gray_scale', _timeit(lambda: gray_scale(white_yellow(img)))),
+        ('WhiteYellowMask gray', _timeit(lambda: white_yellow_mask(img, gray=True))),
+    ], total=False)
+    same = np.array_equal(gray_scale(masked), white_yellow_mask(img, gray=True))
+    print(f"  gray output identical: {same}")
+
+
+def bench_region(img):
+    ''' Per-frame interest_region against the cached mask, full frame against crop-first detection '''
+    edges = cv2.Canny(gray_scale(img), 50, 150)
+    detector = LaneDetector()
+    mask, box = detector._region(img.shape)
+    cropped = LaneDetector(crop=True)
+    _report(f"region of interest {img.shape[1]}x{img.shape[0]}", [
+        ('interest_region', _timeit(lambda: interest_region(edges))),
+        ('cached mask', _timeit(lambda: cv2.bitwise_and(edges, mask))),
+        ('detect', _timeit(lambda: detector.detect(img))),
+        ('detect crop', _timeit(lambda: cropped.detect(img))),
+    ], total=False)
+    rows, cols = img.shape[:2]
+    box_rows, box_cols = box[0].stop - box[0].start, box[1].stop - box[1].start
+    print(f"  crop keeps {box_rows * box_cols / (rows * cols):.0%} of the pixels")
+
+
+def _average_lines_loop(lines):
+    ''' Per segment reference implementation of _average_lines '''
+    left_lanes, left_weights, right_lanes, right_weights = [], [], [], []
+    for line in lines:
+        x1, y1, x2, y2 = line[0]
+        if x1 == x2:
+            continue
+        slope = (y2 - y1)/(x2 - x1)
+        y_intercept = y1 - slope * x1
+        length = np.sqrt((x2 - x1)**2 + (y2 - y1)**2)
+        if slope > 0:
+            right_lanes.append((slope, y_intercept))
+            right_weights.append((length))
+        else:
+            left_lanes.append((slope, y_intercept))
+            left_weights.append((length))
+    left_lane = np.dot(left_weights, left_lanes) / np.sum(left_weights) if len(left_lanes) > 0 else None
+    right_lane = np.dot(right_weights, right_lanes) / np.sum(right_weights) if len(right_lanes) > 0 else None
+    return left_lane, right_lane
+
+
+def bench_average_lines(counts=(10, 100, 500, 2000), seed=0):
+    ''' Per segment loop against the vectorized _average_lines on random Hough output '''
+    rng = np.random.RandomState(seed)
+    stages = []
+    for count in counts:
+        lines = rng.randint(0, 1280, size=(count, 1, 4)).astype(np.int32)
+        for expected, actual in zip(_average_lines_loop(lines), _average_lines(lines)):
+            assert np.allclose(expected, actual)
+        stages.append((f'loop {count}', _timeit(lambda: _average_lines_loop(lines))))
+        stages.append((f'vectorized {count}', _timeit(lambda: _average_lines(lines))))
+    _report("_average_lines segments", stages, total=False)
+
+
+def bench_smoothing(window=50, frames=1000, seed=0):
+    ''' deque + np.mean over the window against LaneSmoother, per frame '''
+    rng = np.random.RandomState(seed)
+    lines = [((int(x1), 648), (int(x2), 388))
+             for x1, x2 in rng.randint(300, 340, size=(frames, 2))]
+    history = deque(maxlen=window)
+    smoother = LaneSmoother(window, max_jump=None)
+
+    def deque_mean():
+        for line in lines:
+            history.append(line)
+            tuple(map(tuple, np.mean(history, axis=0, dtype=np.int32)))
+
+    def running_sum():
+        for line in lines:
+            smoother.update(line)
+
+    _report(f"smoothing window {window}, per frame", [
+        ('deque mean', _timeit(deque_mean, repeat=5) / frames),
+        ('LaneSmoother', _timeit(running_sum, repeat=5) / frames),
+    ], total=False)
+
+
+def bench_video_workers(video, worker_counts=(1, 2, 4)):
+    ''' Frames per second of LaneDetector.process_video_parallel by worker count '''
+    output = os.path.join(tempfile.mkdtemp(), 'output.mp4')
+    print(f"process_video_parallel {os.path.basename(video)} ({os.cpu_count()} cpus)")
+    for workers in worker_counts:
+        fps = LaneDetector().process_video_parallel(video, output, workers=workers)
+        print(f"  {workers} workers{fps:16.1f} frames/s")
+    os.remove(output)
+
+
+def _line_error(line, reference):
+    ''' Mean endpoint distance in pixels, None when only one of them is found '''
+    if line is None or reference is None:
+        return None if line is not reference else 0.0
+    return float(np.mean(np.hypot(*(np.float64(line) - np.float64(reference)).T)))
+
+
+def bench_scale(images, videos, scales=(1.0, 0.75, 0.5, 0.25)):
+    '''
+    Accuracy against full resolution detection on the images and detection
+    frames per second on the video frames, by LaneDetector scale
+    '''
+    images = [cv2.imread(path) for path in images]
+    frames = [frame for video in videos for frame in video_frames(video)][::4]
+    references = [LaneDetector().detect(img) for img in images]
+    print(f"LaneDetector scale ({len(images)} images, {len(frames)} video frames)")
+    print(f"  {'scale':<8}{'error px':>10}{'missed':>8}{'frames/s':>10}")
+    for scale in scales:
+        detector = LaneDetector(scale=scale)
+        errors, missed = [], 0
+        for img, reference in zip(images, references):
+            for line, ref in zip(detector.detect(img), reference):
+                error = _line_error(line, ref)
+                if error is None:
+                    missed += 1
+                else:
+                    errors.append(error)
+        ms = _timeit(lambda: [detector.detect(frame) for frame in frames], repeat=3)
+        fps = len(frames) / ms * 1000 if frames else float('nan')
+        print(f"  {scale:<8}{np.mean(errors):10.1f}{missed:8d}{fps:10.1f}")
+
+
+if __name__ == "__main__":
+    img = cv2.imread(os.path.join(IMAGES_DIR, 'YellowWhite.jpg'))
+    img = cv2.resize(img, (1280, 720))
+    bench_white_yellow(img)
+    bench_region(img)
+    bench_average_lines()
+    bench_smoothing()
+    for video in sorted(glob.glob(os.path.join(VIDEOS_DIR, '*.mp4'))):
+        bench_video_workers(video)
+    bench_scale(sorted(glob.glob(os.path.join(IMAGES_DIR, '*.jpg'))),
+                sorted(glob.glob(os.path.join(VIDEOS_DIR, '*.mp4'))))
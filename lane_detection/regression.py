@@ -0,0 +1,145 @@
+'''
+Lane detection regression harness, run from the repository root.
+Runs the detector over every reference image and input video, reporting
+latency and throughput, and compares the detected lines to golden outputs.
+
+    python lane_detection/regression.py            check against golden.json
+    python lane_detection/regression.py --update   record golden.json
+'''
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import cv2
+import numpy as np
+from run import video_frames, LaneDetector
+
+IMAGES_DIR = os.path.join('lane_detection', 'images')
+VIDEOS_DIR = os.path.join('lane_detection', 'videos', 'input')
+GOLDEN = os.path.join('lane_detection', 'golden.json')
+
+
+def _as_lists(lines):
+    return [None if line is None else [list(map(int, point)) for point in line]
+            for line in lines]
+
+
+def run_images(paths, options, repeat=10):
+    ''' {name: {'lines', 'ms'}} of every image, ms is the median detect time '''
+    results = {}
+    for path in paths:
+        img = cv2.imread(path)
+        detector = LaneDetector(**options)
+        lines = detector.detect(img)
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            detector.detect(img)
+            timings.append((time.perf_counter() - start) * 1000)
+        results[os.path.basename(path)] = {'lines': _as_lists(lines),
+                                           'ms': float(np.median(timings))}
+    return results
+
+
+def run_video(path, options):
+    ''' {'lines', 'fps'} of a video, lines are the raw per frame detections '''
+    detector = LaneDetector(**options)
+    frames = list(video_frames(path))
+    start = time.perf_counter()
+    lines = [_as_lists(detector.detect(frame)) for frame in frames]
+    return {'lines': lines, 'fps': len(frames) / (time.perf_counter() - start)}
+
+
+def _line_mismatch(line, golden, tolerance):
+    if line is None or golden is None:
+        return line is not golden
+    return np.abs(np.subtract(line, golden)).max() > tolerance
+
+
+def compare(results, golden, tolerance=0):
+    ''' Descriptions of every line differing from golden by more than tolerance pixels '''
+    mismatches = []
+    for name, result in results['images'].items():
+        if name not in golden['images']:
+            mismatches.append(f"{name}: no golden output")
+            continue
+        expected = golden['images'][name]['lines']
+        for side, line, golden_line in zip(('left', 'right'), result['lines'], expected):
+            if _line_mismatch(line, golden_line, tolerance):
+                mismatches.append(f"{name} {side}: {line} != {golden_line}")
+    for name, result in results['videos'].items():
+        if name not in golden['videos']:
+            mismatches.append(f"{name}: no golden output")
+            continue
+        expected = golden['videos'][name]['lines']
+        if len(result['lines']) != len(expected):
+            mismatches.append(f"{name}: {len(result['lines'])} frames != {len(expected)}")
+        for idx, (lines, golden_lines) in enumerate(zip(result['lines'], expected)):
+            for side, line, golden_line in zip(('left', 'right'), lines, golden_lines):
+                if _line_mismatch(line, golden_line, tolerance):
+                    mismatches.append(f"{name} frame {idx} {side}: {line} != {golden_line}")
+    return mismatches
+
+
+def _report(results, golden):
+    def delta(value, reference):
+        return f"{(value / reference - 1) * 100:+7.1f}%" if reference else ''
+
+    def throughput(images):
+        total_ms = sum(result['ms'] for result in images.values())
+        return len(images) / total_ms * 1000 if total_ms else None
+
+    print(f"{'image':<28}{'ms':>8}")
+    for name, result in results['images'].items():
+        reference = golden.get('images', {}).get(name, {}).get('ms')
+        print(f"{name:<28}{result['ms']:8.2f} {delta(result['ms'], reference)}")
+    print(f"{'images/s':<28}{throughput(results['images']):8.1f} "
+          f"{delta(throughput(results['images']), throughput(golden.get('images', {})))}")
+    for name, result in results['videos'].items():
+        reference = golden.get('videos', {}).get(name, {}).get('fps')
+        print(f"{name + ' frames/s':<28}{result['fps']:8.1f} {delta(result['fps'], reference)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Lane detection regression harness')
+    parser.add_argument('--update', action='store_true',
+                        help='record the results as the new golden outputs')
+    parser.add_argument('--golden', default=GOLDEN)
+    parser.add_argument('--tolerance', type=int, default=0,
+                        help='max difference in pixels of a line end to the golden one')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='detections per image for the latency median')
+    parser.add_argument('--scale', type=float, default=1.0)
+    parser.add_argument('--crop', action='store_true')
+    args = parser.parse_args()
+
+    options = dict(scale=args.scale, crop=args.crop)
+    results = {
+        'options': options,
+        'images': run_images(sorted(glob.glob(os.path.join(IMAGES_DIR, '*.jpg'))),
+                             options, args.repeat),
+        'videos': {os.path.basename(path): run_video(path, options)
+                   for path in sorted(glob.glob(os.path.join(VIDEOS_DIR, '*.mp4')))}
+    }
+
+    if args.update:
+        with open(args.golden, 'w') as f:
+            json.dump(results, f)
+        _report(results, {})
+        print(f"Recorded {args.golden}")
+        sys.exit(0)
+
+    with open(args.golden) as f:
+        golden = json.load(f)
+    if golden['options'] != options:
+        print(f"Golden outputs were recorded with {golden['options']}, running with {options}")
+    _report(results, golden)
+    mismatches = compare(results, golden, args.tolerance)
+    for mismatch in mismatches:
+        print(mismatch)
+    if mismatches:
+        print(f"{len(mismatches)} lines differ from {args.golden}")
+        sys.exit(1)
+    print(f"All lines match {args.golden}")
@@ -1,9 +1,14 @@
+import argparse
 import cv2
-from matplotlib import pyplot as plt
 import numpy as np
-from collections import deque
-from moviepy.editor import VideoFileClip
+import glob
 import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from queue import Queue, Full
 
 
 def convert_hls(image):
@@ -14,21 +19,59 @@ def gray_scale(img):
     return cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
 
 
+WHITE_LOWER = np.uint8([0, 200,   0])
+WHITE_UPPER = np.uint8([255, 255, 255])
+YELLOW_LOWER = np.uint8([90,   80, 100])
+YELLOW_UPPER = np.uint8([110, 255, 255])
+
+
 def white_yellow(image):
     converted = convert_hls(image)
     # white color mask
-    lower = np.uint8([0, 200,   0])
-    upper = np.uint8([255, 255, 255])
-    white_mask = cv2.inRange(converted, lower, upper)
+    white_mask = cv2.inRange(converted, WHITE_LOWER, WHITE_UPPER)
     # yellow color mask
-    lower = np.uint8([90,   80, 100])
-    upper = np.uint8([110, 255, 255])
-    yellow_mask = cv2.inRange(converted, lower, upper)
+    yellow_mask = cv2.inRange(converted, YELLOW_LOWER, YELLOW_UPPER)
     # combine the mask
     mask = cv2.bitwise_or(white_mask, yellow_mask)
     return cv2.bitwise_and(image, image, mask=mask)
 
 
+class WhiteYellowMask():
+    '''
+    white_yellow, optionally followed by gray_scale, writing into buffers
+    reused across frames of the same shape.
+    The returned image is overwritten by the next call, copy it to keep it.
+    '''
+
+    def __init__(self):
+        self._shape = None
+
+    def _allocate(self, shape):
+        self._shape = shape
+        rows, cols = shape[:2]
+        self._hls = np.empty(shape, dtype=np.uint8)
+        self._white = np.empty((rows, cols), dtype=np.uint8)
+        self._mask = np.empty((rows, cols), dtype=np.uint8)
+        self._gray = np.empty((rows, cols), dtype=np.uint8)
+        self._masked = np.empty(shape, dtype=np.uint8)
+
+    def __call__(self, image, gray=False):
+        if image.shape != self._shape:
+            self._allocate(image.shape)
+        cv2.cvtColor(image, cv2.COLOR_RGB2HLS, dst=self._hls)
+        cv2.inRange(self._hls, WHITE_LOWER, WHITE_UPPER, dst=self._white)
+        cv2.inRange(self._hls, YELLOW_LOWER, YELLOW_UPPER, dst=self._mask)
+        cv2.bitwise_or(self._white, self._mask, dst=self._mask)
+        if gray:
+            # black stays black, so masking the gray image equals graying the
+            # masked one, and the 0/255 mask applies as a plain bitwise and
+            cv2.cvtColor(image, cv2.COLOR_RGB2GRAY, dst=self._gray)
+            return cv2.bitwise_and(self._gray, self._mask, dst=self._gray)
+        # a masked operation leaves the pixels outside the mask untouched
+        self._masked.fill(0)
+        return cv2.bitwise_and(image, image, dst=self._masked, mask=self._mask)
+
+
 def gaussian_smoothing(img, kernel_size=15):
     return cv2.GaussianBlur(img, (kernel_size, kernel_size), 0)
 
@@ -43,127 +86,734 @@ def filter_region(img, vertices):
     return cv2.bitwise_and(img, mask)
 
 
-def interest_region(img):
-    rows, cols = img.shape
-    bottom_left = [cols*0.1, rows*0.95]
-    top_left = [cols*0.4, rows*0.6]
-    bottom_right = [cols*0.9, rows*0.95]
-    top_right = [cols*0.6, rows*0.6]
-    vertices = np.array([[bottom_left, top_left, top_right,
-                          bottom_right]], dtype=np.int32)
-    return filter_region(img, vertices)
+# (x, y) frame fractions of the bottom left, top left, top right and bottom right corners
+DEFAULT_ROI = ((0.1, 0.95), (0.4, 0.6), (0.6, 0.6), (0.9, 0.95))
 
 
-def hough_lines(img):
-    return cv2.HoughLinesP(img, rho=1, theta=np.pi/180, threshold=20, minLineLength=20, maxLineGap=300)
+def interest_vertices(shape, roi=DEFAULT_ROI):
+    rows, cols = shape[:2]
+    return np.array([[[cols*x, rows*y] for x, y in roi]], dtype=np.int32)
 
 
-def _average_lines(lines):
-    left_lanes = []
-    left_weights = []
-    right_lanes = []
-    right_weights = []
+def interest_region(img, roi=DEFAULT_ROI):
+    return filter_region(img, interest_vertices(img.shape, roi))
 
-    for line in lines:
-        x1, y1, x2, y2 = line[0]
-        if x1 == x2:
-            # skip vertical lines
-            continue
 
-        slope = (y2 - y1)/(x2 - x1)
-        y_intercept = y1 - slope * x1
-        length = np.sqrt((x2 - x1)**2 + (y2 - y1)**2)
+def hough_lines(img, threshold=20, min_line_length=20, max_line_gap=300):
+    return cv2.HoughLinesP(img, rho=1, theta=np.pi/180, threshold=threshold,
+                           minLineLength=min_line_length, maxLineGap=max_line_gap)
+
+
+# max distance in pixels of a segment end to its lane line to count as lying on it
+LINE_TOLERANCE = 10
+
+
+def _weighted_lane(segments, slopes, intercepts, lengths, selected):
+    ''' Length weighted (slope, intercept) of the selected segments and the share of their length lying on it '''
+    weights = lengths[selected]
+    if weights.size == 0:
+        return None, 0.0
+    total = np.sum(weights)
+    slope, intercept = np.array([np.dot(weights, slopes[selected]),
+                                 np.dot(weights, intercepts[selected])]) / total
+    x1, y1, x2, y2 = segments[selected].T
+    distances = np.maximum(np.abs(slope * x1 - y1 + intercept),
+                           np.abs(slope * x2 - y2 + intercept)) / np.hypot(slope, 1)
+    confidence = np.sum(weights[distances <= LINE_TOLERANCE]) / total
+    return np.array([slope, intercept]), float(confidence)
+
+
+def _weighted_lanes(lines):
+    ''' ((slope, intercept), confidence) of the left and right lanes from (N, 1, 4) Hough segments '''
+    if lines is None or len(lines) == 0:
+        return (None, 0.0), (None, 0.0)
+    segments = np.asarray(lines, dtype=np.float64).reshape(-1, 4)
+    x1, y1, x2, y2 = segments.T
+    dx = x2 - x1
+    dy = y2 - y1
+    # skip vertical lines
+    valid = dx != 0
+    slopes = np.divide(dy, dx, out=np.zeros_like(dy), where=valid)
+    intercepts = y1 - slopes * x1
+    lengths = np.hypot(dx, dy)
+
+    # y is reversed
+    right = valid & (slopes > 0)
+    left = valid & ~(slopes > 0)
+    return (_weighted_lane(segments, slopes, intercepts, lengths, left),
+            _weighted_lane(segments, slopes, intercepts, lengths, right))
 
-        # y is reversed
-        if slope > 0:
-            right_lanes.append((slope, y_intercept))
-            right_weights.append((length))
-        else:
-            left_lanes.append((slope, y_intercept))
-            left_weights.append((length))
 
-    left_lane = np.dot(left_weights, left_lanes) / np.sum(left_weights) if len(left_lanes) > 0 else None
-    right_lane = np.dot(right_weights, right_lanes) / np.sum(right_weights) if len(right_lanes) > 0 else None
+def _average_lines(lines):
+    ''' Length weighted (slope, intercept) of the left and right lanes from (N, 1, 4) Hough segments '''
+    (left_lane, _), (right_lane, _) = _weighted_lanes(lines)
     return left_lane, right_lane
 
 
-def lane_lines(img, lines):
-    left_line, right_line = _average_lines(lines)
+def _lane_points(lane, y1, y2):
+    ''' (slope, intercept) to end points at rows y1 and y2, None for missing or flat lanes '''
+    if lane is None or lane[0] == 0:
+        return None
+    slope, intercept = lane
+    x1 = (y1 - intercept) / slope
+    x2 = (y2 - intercept) / slope
+    return ((int(x1), int(y1)), (int(x2), int(y2)))
+
+
+def _weighted_lane_lines(img, lines):
+    ''' lane_lines along with the confidence of each line '''
+    (left_lane, left_confidence), (right_lane, right_confidence) = _weighted_lanes(lines)
 
     y1 = img.shape[0] * 0.9
     y2 = y1 * 0.6
-    print(left_line)
-    if left_line is not None:
-        # left line
-        x1 = (y1 - left_line[1]) / left_line[0]
-        x2 = (y2 - left_line[1]) / left_line[0]
-        left_line = ((int(x1), int(y1)), (int(x2), int(y2)))
-    if right_line is not None:
-        # right line
-        x1 = (y1 - right_line[1]) / right_line[0]
-        x2 = (y2 - right_line[1]) / right_line[0]
-        right_line = ((int(x1), int(y1)), (int(x2), int(y2)))
-
-    return left_line, right_line
-
-def draw_lines(img, lines):
+    return ((_lane_points(left_lane, y1, y2), _lane_points(right_lane, y1, y2)),
+            (left_confidence, right_confidence))
+
+
+def lane_lines(img, lines):
+    return _weighted_lane_lines(img, lines)[0]
+
+
+def _line_geometry(line, confidence):
+    if line is None:
+        return None
+    (x1, y1), (x2, y2) = line
+    return {
+        'points': line,
+        'slope': (y2 - y1) / (x2 - x1) if x2 != x1 else float('inf'),
+        'confidence': confidence
+    }
+
+
+def lane_geometry(shape, lines, confidences=(0.0, 0.0)):
+    '''
+    Steering friendly description of (left, right) lines: end points, slope and
+    confidence of each line, and the offset in pixels of the lane centre from
+    the frame centre at the bottom of the lines, positive when the lane centre
+    is on the right. confidences are the share of the Hough segments length
+    lying on each line, see LINE_TOLERANCE.
+    '''
+    left_line, right_line = lines
+    offset = None
+    if left_line is not None and right_line is not None:
+        offset = (left_line[0][0] + right_line[0][0]) / 2 - shape[1] / 2
+    return {
+        'left': _line_geometry(left_line, confidences[0]),
+        'right': _line_geometry(right_line, confidences[1]),
+        'offset': offset
+    }
+
+
+def draw_lines(img, lines, inplace=False):
+    '''
+    Overlay lines in red. inplace draws solid lines straight onto img instead
+    of blending them in from a second full size image.
+    '''
+    if inplace:
+        for line in lines:
+            if line is not None:
+                cv2.line(img, line[0], line[1], (0, 0, 255), 10)
+        return img
+
     img_lines = np.zeros_like(img)
     for line in lines:
+        if line is None:
+            continue
         cv2.line(img_lines, line[0], line[1], (0, 0, 255), 10)
 
     return cv2.addWeighted(img, 1, img_lines, 1, 0)
 
+
+def video_frames(path):
+    ''' Frames of a video file '''
+    capture = cv2.VideoCapture(path)
+    try:
+        while True:
+            success, frame = capture.read()
+            if not success:
+                return
+            yield frame
+    finally:
+        capture.release()
+
+
+def image_frames(directory, pattern='*.jpg'):
+    ''' Images of a directory, sorted by name '''
+    for path in sorted(glob.glob(os.path.join(directory, pattern))):
+        yield cv2.imread(path)
+
+
+def socket_frames(source, poll=0.005, decoded=False, stop=None):
+    '''
+    Decoded frames of anything with get_latest(seq) returning encoded images,
+    such as the server CameraSocket. Frames are fetched when asked for, so a
+    slow consumer skips to the latest frame instead of lagging behind.
+    decoded: use source.get_decoded(seq) instead, returning images decoded
+        already and possibly shared, hence read-only
+    stop: threading.Event ending the frames, even while waiting for one
+    '''
+    seq = 0
+    while stop is None or not stop.is_set():
+        if decoded:
+            latest_seq, img = source.get_decoded(seq)
+            new = latest_seq != seq
+            seq = latest_seq
+        else:
+            seq, frame = source.get_latest(seq)
+            new = frame is not None
+            img = cv2.imdecode(np.frombuffer(frame, dtype=np.uint8), cv2.IMREAD_COLOR) if new else None
+        if not new:
+            time.sleep(poll)
+            continue
+        if img is not None:
+            yield img
+
+
+def prefetch_frames(frames, size=4, timeout=1):
+    '''
+    Read frames in a background thread, at most `size` ahead of the consumer.
+    On close, the reader is waited for at most `timeout` seconds, a source
+    blocked waiting for a frame only stops at its next one.
+    '''
+    queue = Queue(maxsize=size)
+    stop = threading.Event()
+    done = object()
+    errors = []
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def read():
+        try:
+            for frame in frames:
+                if not put(frame):
+                    return
+        except Exception as error:
+            errors.append(error)
+        put(done)
+
+    thread = threading.Thread(target=read, daemon=True)
+    thread.start()
+    try:
+        while True:
+            frame = queue.get()
+            if frame is done:
+                break
+            yield frame
+        if errors:
+            raise errors[0]
+    finally:
+        stop.set()
+        thread.join(timeout)
+
+
+class LaneSmoother():
+    '''
+    Average of a lane line over the last `window` frames, or an exponential
+    moving average when `decay` is set, with O(1) updates and reads.
+    Lines further than `max_jump` pixels from the average are ignored as
+    outliers, unless `max_rejects` of them come in a row. The confidences of
+    the lines are averaged along with them, see confidence.
+    '''
+
+    def __init__(self, window=50, decay=None, max_jump=100, max_rejects=10):
+        self.window = window
+        self.decay = decay
+        self.max_jump = max_jump
+        self.max_rejects = max_rejects
+        # x1, y1, x2, y2 and confidence of the last lines
+        self._lines = np.zeros((window, 5))
+        self.reset()
+
+    def reset(self):
+        self._sum = np.zeros(5)
+        self._average = None
+        self._count = 0
+        self._index = 0
+        self._rejects = 0
+
+    def __len__(self):
+        return self._count
+
+    def _accepts(self, line):
+        if self._average is None or self.max_jump is None:
+            return True
+        if np.max(np.abs(line[:4] - self._average[:4])) <= self.max_jump:
+            self._rejects = 0
+            return True
+        self._rejects += 1
+        if self._rejects >= self.max_rejects:
+            # the lane really moved, start over from this line
+            self.reset()
+            return True
+        return False
+
+    def _add(self, line):
+        if self.decay is not None:
+            if self._average is None:
+                self._average = line
+            else:
+                self._average = self.decay * self._average + (1 - self.decay) * line
+            self._count = min(self._count + 1, self.window)
+            return
+        if self._count == self.window:
+            self._sum -= self._lines[self._index]
+        else:
+            self._count += 1
+        self._lines[self._index] = line
+        self._sum += line
+        self._index = (self._index + 1) % self.window
+        if self._index == 0 and self._count == self.window:
+            # drop the rounding error accumulated over a full window
+            self._sum = self._lines.sum(axis=0)
+        self._average = self._sum / self._count
+
+    def update(self, line, confidence=0.0):
+        ''' Add a ((x1, y1), (x2, y2)) line, None when not detected, and return the average line '''
+        if line is not None:
+            line = np.append(np.reshape(line, 4), confidence).astype(np.float64)
+            if self._accepts(line):
+                self._add(line)
+        return self.line()
+
+    def line(self):
+        if self._average is None:
+            return None
+        x1, y1, x2, y2 = self._average[:4].astype(np.int32).tolist()
+        return ((x1, y1), (x2, y2))
+
+    def confidence(self):
+        ''' Average confidence of the lines making the average line, 0 without one '''
+        return 0.0 if self._average is None else float(self._average[4])
+
+
+class StageProfiler():
+    '''
+    Per-stage call counts and wall time histograms with power of two buckets
+    from 1us, plus the peak bytes allocated by each call when `allocations`
+    is set, which traces allocations and slows everything down. tracemalloc
+    peaks are process wide, so allocations are only traced single threaded.
+    '''
+    BUCKETS = 24
+
+    def __init__(self, allocations=False):
+        self.allocations = allocations
+        self._stats = {}
+        self._lock = threading.Lock()
+        if allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def wrap(self, stage, fn):
+        ''' fn recording its calls under `stage` '''
+        stats = self._stats.setdefault(
+            stage, {'calls': 0, 'total': 0.0, 'max': 0.0, 'allocated': 0,
+                    'histogram': np.zeros(self.BUCKETS, dtype=np.int64)})
+
+        def timed(*args, **kwargs):
+            if self.allocations:
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter()
+            result = fn(*args, **kwargs)
+            elapsed = time.perf_counter() - start
+            allocated = tracemalloc.get_traced_memory()[1] - before if self.allocations else 0
+            bucket = min(int(elapsed * 1e6).bit_length(), self.BUCKETS - 1)
+            with self._lock:
+                stats['calls'] += 1
+                stats['total'] += elapsed
+                stats['max'] = max(stats['max'], elapsed)
+                stats['allocated'] += allocated
+                stats['histogram'][bucket] += 1
+            return result
+
+        return timed
+
+    def _percentile(self, histogram, fraction):
+        ''' Upper bound in ms of the bucket holding the fraction of calls '''
+        bucket = int(np.searchsorted(np.cumsum(histogram), fraction * histogram.sum()))
+        return (1 << bucket) / 1000
+
+    def summary(self):
+        total = sum(stats['total'] for stats in self._stats.values()) or 1
+        header = f"{'stage':<20}{'calls':>8}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'share':>8}"
+        if self.allocations:
+            header += f"{'alloc KB':>10}"
+        rows = [header]
+        for stage, stats in self._stats.items():
+            if not stats['calls']:
+                continue
+            row = (f"{stage:<20}{stats['calls']:>8}"
+                   f"{stats['total'] / stats['calls'] * 1000:>10.3f}"
+                   f"{self._percentile(stats['histogram'], 0.5):>10.3f}"
+                   f"{self._percentile(stats['histogram'], 0.99):>10.3f}"
+                   f"{stats['max'] * 1000:>10.3f}"
+                   f"{stats['total'] / total:>8.1%}")
+            if self.allocations:
+                row += f"{stats['allocated'] / stats['calls'] / 1024:>10.1f}"
+            rows.append(row)
+        return '\n'.join(rows)
+
+
 class LaneDetector():
+    # stages timed by profile(), each one is a method prefixed with _ but smooth
+    STAGES = ('downscale', 'white_yellow', 'gaussian_smoothing', 'canny_edges', 'interest_region',
+              'hough_lines', 'lane_lines', 'smooth', 'draw_lines')
+
+    def __init__(self, roi=DEFAULT_ROI, crop=False, window=50, decay=None, max_jump=100, scale=1.0):
+        '''
+        roi: frame fractions of the region of interest corners, see DEFAULT_ROI
+        crop: run the whole pipeline on the region of interest bounding box only,
+            lines may move by a few pixels since blur and edges stop at the box
+        window, decay, max_jump: temporal smoothing, see LaneSmoother
+        scale: detect on the frame resized by this factor, lines are mapped back
+            to full resolution. Powers of 1/2 go through an image pyramid.
+        '''
+        if not 0 < scale <= 1:
+            raise ValueError(f"scale must be in (0, 1], got {scale}")
+        # to build identical detectors in worker processes
+        self._options = dict(roi=roi, crop=crop, window=window,
+                             decay=decay, max_jump=max_jump, scale=scale)
+        self.left_lines = LaneSmoother(window, decay, max_jump)
+        self.right_lines = LaneSmoother(window, decay, max_jump)
+        self.roi = tuple(map(tuple, roi))
+        self.crop = crop
+        self.scale = scale
+        levels = np.log2(1 / scale)
+        self._pyramid_levels = int(levels) if levels == int(levels) else None
+        # pixel sized parameters follow the processed resolution
+        self._kernel_size = max(3, int(15 * scale) | 1)
+        self._hough = dict(threshold=max(1, round(20 * scale)),
+                           min_line_length=max(1, round(20 * scale)),
+                           max_line_gap=max(1, round(300 * scale)))
+        self._color_mask = WhiteYellowMask()
+        self._regions = {}
+        self.profiler = None
+
+    def profile(self, profiler=None):
+        ''' Time every stage into profiler, a new StageProfiler by default, and return it '''
+        self.profiler = profiler or StageProfiler()
+        for stage in self.STAGES:
+            name = stage if stage == 'smooth' else f'_{stage}'
+            # instance attributes shadow the methods, unprofiled detectors pay nothing
+            setattr(self, name, self.profiler.wrap(stage, getattr(self, name)))
+        return self.profiler
+
+    def _region(self, shape):
+        ''' Cached (mask, bounding box slices) of the region of interest for a frame shape '''
+        key = (shape[:2], self.roi, self.crop, self.scale)
+        if key not in self._regions:
+            rows, cols = shape[:2]
+            vertices = interest_vertices(shape, self.roi)
+            mask = np.zeros((rows, cols), dtype=np.uint8)
+            cv2.fillPoly(mask, vertices, 255)
+            x, y, w, h = cv2.boundingRect(vertices)
+            box = (slice(max(y, 0), min(y + h, rows)),
+                   slice(max(x, 0), min(x + w, cols)))
+            if self.crop:
+                mask = np.ascontiguousarray(mask[box])
+            if self.scale != 1:
+                # same reduction as the frames so that shapes match
+                mask = self._downscale(mask)
+                mask = cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY)[1]
+            self._regions[key] = (mask, box)
+        return self._regions[key]
+
+    def _downscale(self, img):
+        if self._pyramid_levels is not None:
+            for _ in range(self._pyramid_levels):
+                img = cv2.pyrDown(img)
+            return img
+        return cv2.resize(img, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+
+    def _white_yellow(self, img):
+        return self._color_mask(img, gray=True)
+
+    def _gaussian_smoothing(self, img):
+        return gaussian_smoothing(img, self._kernel_size)
+
+    def _canny_edges(self, img):
+        return canny_edges(img)
+
+    def _interest_region(self, img, mask):
+        return cv2.bitwise_and(img, mask, dst=img)
+
+    def _hough_lines(self, img):
+        return hough_lines(img, **self._hough)
+
+    def _lane_lines(self, img, lines):
+        return _weighted_lane_lines(img, lines)
+
+    def _draw_lines(self, img, lines, inplace=False):
+        return draw_lines(img, lines, inplace)
+
+    def detect(self, img):
+        ''' Left and right lines of a single frame, None when not found '''
+        return self._detect(img)[0]
+
+    def geometry(self, img, smooth=True):
+        '''
+        lane_geometry of a frame, nothing is rendered. Smoothed lines come
+        with the average confidence of the lines they average, see LaneSmoother.
+        '''
+        lines, confidences = self._detect(img)
+        if smooth:
+            lines = self.smooth(*lines, confidences=confidences)
+            confidences = (self.left_lines.confidence(), self.right_lines.confidence())
+        return lane_geometry(img.shape, lines, confidences)
+
+    def _detect(self, img):
+        ''' (left, right) lines of a frame and their confidences '''
+        mask, box = self._region(img.shape)
+        frame = img[box] if self.crop else img
+        if self.scale != 1:
+            frame = self._downscale(frame)
+        img_processed = self._white_yellow(frame)
+        img_processed = self._gaussian_smoothing(img_processed)
+        img_processed = self._canny_edges(img_processed)
+        img_processed = self._interest_region(img_processed, mask)
+        lines = self._hough_lines(img_processed)
+        if self.scale != 1 and lines is not None:
+            # back to full resolution, pyrDown rounds odd sizes up
+            rows, cols = frame.shape[:2]
+            full_rows, full_cols = img[box].shape[:2] if self.crop else img.shape[:2]
+            lines = np.rint(lines * np.float32([full_cols / cols, full_rows / rows] * 2)).astype(np.int32)
+        if self.crop and lines is not None:
+            # back to full frame coordinates
+            lines += np.int32([box[1].start, box[0].start,
+                               box[1].start, box[0].start])
+        return self._lane_lines(img, lines)
+
+    def smooth(self, left_line, right_line, confidences=(0.0, 0.0)):
+        ''' Store the frame lines and return the mean lines over the last frames '''
+        return (self.left_lines.update(left_line, confidences[0]),
+                self.right_lines.update(right_line, confidences[1]))
+
+    def process(self, img, inplace=False):
+        left_line, right_line = self.smooth(*self.detect(img))
+        final_img = self._draw_lines(img, [left_line, right_line], inplace)
 
-    def __init__(self):
-        self.left_lines = deque(maxlen=50)
-        self.right_lines = deque(maxlen=50)
-
-    def process(self, img):
-        img_processed = white_yellow(img)
-        
-        img_processed = gray_scale(img_processed)
-        img_processed = gaussian_smoothing(img_processed)
-        img_processed = canny_edges(img_processed)
-        img_processed = interest_region(img_processed)
-        lines = hough_lines(img_processed)
-        left_line, right_line = lane_lines(img_processed, lines)
-
-        # store lines
-        if left_line is not None:
-            self.left_lines.append(left_line)
-        if right_line is not None:
-            self.right_lines.append(right_line)
-
-        # mean lines
-        if len(self.left_lines) > 0:
-            left_line = tuple(
-                map(tuple, np.mean(self.left_lines, axis=0, dtype=np.int32)))
-        if len(self.right_lines) > 0:
-            right_line = tuple(
-                map(tuple, np.mean(self.right_lines, axis=0, dtype=np.int32)))
-
-        final_img = draw_lines(img, [left_line, right_line])
-        
         return final_img
 
+    def pipeline(self, frames, smooth=True, draw=True, inplace=False, workers=1, prefetch=0,
+                 on_error=None):
+        '''
+        Lazily run the detector over an iterator of frames, see video_frames,
+        image_frames and socket_frames, yielding (frame, (left, right), overlay) in order.
+        smooth: average lines over time, per frame lines otherwise
+        draw: draw lines over the frame, overlay is None otherwise
+        inplace: draw onto the frame itself, see draw_lines
+        workers: detect that many frames at once in threads, the cv2 stages release the GIL
+        prefetch: read that many frames ahead in a background thread, keep 0
+            for live sources so that the latest frame is picked
+        on_error: called with (frame, exception) for frames failing, which
+            are skipped, the first failure ends the pipeline otherwise
+        '''
+        if prefetch:
+            frames = prefetch_frames(frames, prefetch)
+        for frame, lines in self._detect_frames(frames, workers, on_error is not None):
+            if isinstance(lines, Exception):
+                on_error(frame, lines)
+                continue
+            try:
+                if smooth:
+                    lines = self.smooth(*lines)
+                overlay = self._draw_lines(frame, lines, inplace) if draw else None
+            except Exception as error:
+                if on_error is None:
+                    raise
+                on_error(frame, error)
+                continue
+            yield frame, lines, overlay
+
+    def _detect_frames(self, frames, workers, catch=False):
+        ''' (frame, lines) in order, lines being the exception raised if catch '''
+        def catching(detect):
+            def safe_detect(frame):
+                try:
+                    return detect(frame)
+                except Exception as error:
+                    if not catch:
+                        raise
+                    return error
+            return safe_detect
+
+        if workers <= 1:
+            detect = catching(self.detect)
+            for frame in frames:
+                yield frame, detect(frame)
+            return
+
+        if self.profiler is not None and self.profiler.allocations:
+            raise ValueError("allocation profiling needs workers=1, "
+                             "tracemalloc peaks mix up concurrent stages")
+
+        # detection buffers are per detector, one detector per thread
+        local = threading.local()
+
+        def detect(frame):
+            if not hasattr(local, 'detector'):
+                local.detector = LaneDetector(**self._options)
+                if self.profiler is not None:
+                    local.detector.profile(self.profiler)
+            return local.detector.detect(frame)
+
+        detect = catching(detect)
+        with ThreadPoolExecutor(workers) as pool:
+            pending = deque()
+            for frame in frames:
+                pending.append((frame, pool.submit(detect, frame)))
+                if len(pending) >= workers:
+                    frame, future = pending.popleft()
+                    yield frame, future.result()
+            while pending:
+                frame, future = pending.popleft()
+                yield frame, future.result()
+
     def process_video(self, input, output):
-        clip = VideoFileClip(input)
-        processed = clip.fl_image(detector.process)
-        processed.write_videofile(output, audio=False)
+        '''
+        Detect, smooth, draw and write every frame in order, the sequential
+        process_video_parallel. Returns the processed frames per second.
+        '''
+        _, writer = _video_writer(input, output)
+        started = time.perf_counter()
+        frames = 0
+        for frame in video_frames(input):
+            writer.write(self.process(frame))
+            frames += 1
+        writer.release()
+        return frames / (time.perf_counter() - started)
+
+    def process_video_parallel(self, input, output, workers=None, chunk_size=16):
+        '''
+        Decode and detect lines on chunks of `chunk_size` frames in a pool of
+        `workers` processes, then smooth, draw and write every frame in order
+        here. At most workers + 1 decoded chunks are in flight, which bounds
+        memory. A chunk shorter than asked, the announced frame count being
+        wrong, ends the pool and the rest is read sequentially.
+        Returns the processed frames per second.
+        '''
+        workers = workers or os.cpu_count()
+        count, writer = _video_writer(input, output)
+        starts = range(0, count, chunk_size)
+        # the last chunk reads past the announced count
+        chunks = iter([(input, start, start + chunk_size if start + chunk_size < count else None,
+                        self._options) for start in starts])
+
+        started = time.perf_counter()
+        frames = 0
+        complete = True
+        with ProcessPoolExecutor(workers) as pool:
+            pending = deque((chunk, pool.submit(_detect_chunk, chunk))
+                            for _, chunk in zip(range(workers + 1), chunks))
+            while pending:
+                (_, start, stop, _), future = pending.popleft()
+                chunk_frames, chunk_lines = future.result()
+                for frame, lines in zip(chunk_frames, chunk_lines):
+                    # smoothing stays sequential, so chunk boundaries do not matter
+                    writer.write(self._draw_lines(frame, self.smooth(*lines)))
+                    frames += 1
+                if stop is not None and len(chunk_frames) < stop - start:
+                    complete = False
+                    for _, future in pending:
+                        future.cancel()
+                    break
+                chunk = next(chunks, None)
+                if chunk is not None:
+                    pending.append((chunk, pool.submit(_detect_chunk, chunk)))
+        if not complete or count == 0:
+            capture = _open_at(input, frames)
+            while True:
+                success, frame = capture.read()
+                if not success:
+                    break
+                writer.write(self.process(frame))
+                frames += 1
+            capture.release()
+        writer.release()
+        return frames / (time.perf_counter() - started)
+
+
+def _video_writer(input, output):
+    ''' (announced frame count, mp4 writer at the frame rate and size) of a video '''
+    capture = cv2.VideoCapture(input)
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    size = (int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    capture.release()
+    return count, cv2.VideoWriter(output, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+
+
+def _open_at(input, start):
+    ''' Capture of a video about to read frame start '''
+    capture = cv2.VideoCapture(input)
+    if start == 0:
+        return capture
+    if capture.set(cv2.CAP_PROP_POS_FRAMES, start) and int(capture.get(cv2.CAP_PROP_POS_FRAMES)) == start:
+        return capture
+    # seeking is not frame exact with every codec, skip frames one by one instead
+    capture.release()
+    capture = cv2.VideoCapture(input)
+    for _ in range(start):
+        if not capture.grab():
+            break
+    return capture
+
+
+def _detect_chunk(args):
+    ''' Frames [start, stop) of a video, to its end if stop is None, and their raw (left, right) lines '''
+    input, start, stop, options = args
+    detector = LaneDetector(**options)
+    capture = _open_at(input, start)
+    frames, lines = [], []
+    while stop is None or start + len(frames) < stop:
+        success, frame = capture.read()
+        if not success:
+            break
+        frames.append(frame)
+        lines.append(detector.detect(frame))
+    capture.release()
+    return frames, lines
 
 
 if __name__ == "__main__":
-    detector = LaneDetector()
-
-    img_original = cv2.imread('./lane_detection/images/YellowWhite.jpg')  # rgb
-    img = detector.process(img_original)
-    
-    # cv2.imshow('image', img)
-    # cv2.waitKey(0)
-    # cv2.destroyAllWindows()
-    input_video = os.path.join(
-        'lane_detection', 'videos', 'input', 'challenge.mp4')
-    output_video = os.path.join(
-        'lane_detection', 'videos', 'output', 'challenge-output.mp4')
-    detector.process_video(input_video, output_video)
+    parser = argparse.ArgumentParser(description='Detect lanes on a video')
+    parser.add_argument('--input', default=os.path.join(
+        'lane_detection', 'videos', 'input', 'challenge.mp4'))
+    parser.add_argument('--output', default=os.path.join(
+        'lane_detection', 'videos', 'output', 'challenge-output.mp4'))
+    parser.add_argument('--profile', action='store_true',
+                        help='print a per-stage breakdown over the input video instead of writing the output')
+    parser.add_argument('--allocations', action='store_true',
+                        help='with --profile, also trace the bytes allocated by each stage')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='detect on frames resized by this factor, e.g. 0.5')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='decode and detect chunks of frames in that many processes')
+    args = parser.parse_args()
+
+    detector = LaneDetector(scale=args.scale)
+
+    if args.profile:
+        profiler = detector.profile(StageProfiler(allocations=args.allocations))
+        for _ in detector.pipeline(video_frames(args.input)):
+            pass
+        print(profiler.summary())
+    else:
+        img_original = cv2.imread('./lane_detection/images/YellowWhite.jpg')  # rgb
+        img = detector.process(img_original)
+
+        # cv2.imshow('image', img)
+        # cv2.waitKey(0)
+        # cv2.destroyAllWindows()
+        if args.workers > 1:
+            fps = detector.process_video_parallel(args.input, args.output, workers=args.workers)
+        else:
+            fps = detector.process_video(args.input, args.output)
+        print(f"{fps:.1f} frames/s")
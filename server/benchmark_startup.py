@@ -0,0 +1,49 @@
+''' Measure server import time and launch-to-first-response time '''
+import os
+import subprocess
+import sys
+import time
+from urllib.request import urlopen
+from urllib.error import URLError
+import config
+
+DIRNAME = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_time(module='server', runs=5):
+    ''' Best wall time in ms to import `module` in a fresh interpreter '''
+    code = ('import time; t = time.perf_counter(); '
+            f'import {module}; print((time.perf_counter() - t) * 1000)')
+    timings = []
+    for _ in range(runs):
+        out = subprocess.check_output([sys.executable, '-c', code], cwd=DIRNAME)
+        timings.append(float(out))
+    return min(timings)
+
+
+def startup_time(timeout=30):
+    ''' Wall time in ms between launching run.py and the first served index '''
+    url = f"http://127.0.0.1:{config.SERVER['port']}/"
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, 'run.py'], cwd=DIRNAME,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                urlopen(url, timeout=1).read()
+                return (time.perf_counter() - start) * 1000
+            except (URLError, ConnectionError):
+                time.sleep(0.005)
+        raise TimeoutError(f"server not ready after {timeout}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == '__main__':
+    target = config.SERVER['startup_target_ms']
+    print(f"import server: {import_time():.1f} ms")
+    elapsed = startup_time()
+    status = 'OK' if elapsed <= target else 'SLOW'
+    print(f"startup: {elapsed:.1f} ms (target {target} ms) {status}")
+    sys.exit(0 if elapsed <= target else 1)
@@ -1,7 +1,45 @@
-CAMERA = {
-  'address': 'tcp://0.0.0.0:8089'
+# one entry per camera, streamed on /camera/<name>.mjpg
+CAMERAS = {
+  'front': {
+    'address': 'tcp://0.0.0.0:8089'
+  }
+}
+
+# composite of all cameras on /camera_mosaic.mjpg, built when there are
+# at least two cameras
+MOSAIC = {
+  'tile_size': (320, 240),
+  'fps': 10,
+  'quality': 80
+}
+
+# lane detection overlay of one camera on /camera_feed_lanes.mjpg, the
+# detected left/right lines are emitted on the /lanes socket.io namespace
+LANES = {
+  'enabled': False,
+  'camera': 'front',
+  'workers': 2,
+  'quality': 80,
+  # detection resolution factor, lines are drawn at full resolution
+  'scale': 0.5
 }
 
 RADARS = {
   'address': 'tcp://0.0.0.0:8090'
-}
\ No newline at end of file
+}
+
+SERVER = {
+  'host': '0.0.0.0',
+  'port': 8080,
+  # > 1 ingests in the main process and serves from this many worker
+  # processes, e.g. os.cpu_count() - 1
+  'workers': 1,
+  # time budget between process launch and first served request
+  'startup_target_ms': 1500
+}
+
+# shared memory ring between the ingest process and the server workers
+FRAME_RING = {
+  'slots': 16,
+  'slot_size': 512 * 1024
+}
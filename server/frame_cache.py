@@ -0,0 +1,70 @@
+import threading
+
+
+class _Frame():
+    __slots__ = ('seq', 'data', '_image', '_decoded', '_lock')
+
+    def __init__(self, seq, data):
+        self.seq = seq
+        self.data = data
+        self._image = None
+        self._decoded = False
+        self._lock = threading.Lock()
+
+    def image(self):
+        ''' Decoded image, decoded by the first caller only, None if undecodable '''
+        with self._lock:
+            if not self._decoded:
+                # only vision consumers pay for the cv2 import
+                import cv2
+                import numpy as np
+                img = cv2.imdecode(np.frombuffer(self.data, dtype=np.uint8), cv2.IMREAD_COLOR)
+                if img is not None:
+                    # shared by every consumer
+                    img.flags.writeable = False
+                self._image = img
+                self._decoded = True
+        return self._image
+
+
+class FrameCache():
+    '''
+    Newest encoded frame along with its decoded image. Frames are decoded
+    lazily, once, whatever the number of consumers asking for them. Only the
+    newest frame is kept, older ones live as long as a consumer holds them.
+    Decoded images are shared, hence read-only: copy them before drawing.
+    '''
+
+    def __init__(self):
+        self._latest = None
+        self._lock = threading.Lock()
+
+    def put(self, data):
+        ''' Store an encoded frame, returns its sequence number '''
+        with self._lock:
+            seq = self._latest.seq + 1 if self._latest is not None else 1
+            self._latest = _Frame(seq, data)
+        return seq
+
+    def _newest(self, seq):
+        latest = self._latest
+        if latest is None or latest.seq <= seq:
+            return None
+        return latest
+
+    def get_latest(self, seq=0):
+        ''' Get (seq, frame) of the newest encoded frame after seq, frame is None if nothing new '''
+        latest = self._newest(seq)
+        if latest is None:
+            return seq, None
+        return latest.seq, latest.data
+
+    def get_decoded(self, seq=0):
+        '''
+        Get (seq, image) of the newest decoded frame after seq, image is None
+        if nothing new or if the frame could not be decoded
+        '''
+        latest = self._newest(seq)
+        if latest is None:
+            return seq, None
+        return latest.seq, latest.image()
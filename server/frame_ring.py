@@ -0,0 +1,82 @@
+import logging
+import struct
+from multiprocessing import shared_memory
+logger = logging.getLogger(__name__)
+
+# latest published sequence number
+_HEADER = struct.Struct('Q')
+# per slot: sequence number (0 while being written), payload length
+_SLOT_HEADER = struct.Struct('QQ')
+
+
+class FrameRing():
+    '''
+    Single writer, many readers ring of byte payloads in shared memory.
+    Readers poll with the last sequence number they have seen and copy the
+    newest payload out, retrying if the writer lapped them during the copy.
+    '''
+
+    def __init__(self, name=None, slots=16, slot_size=512 * 1024, create=False):
+        self.slots = slots
+        self.slot_size = slot_size
+        self._stride = _SLOT_HEADER.size + slot_size
+        size = _HEADER.size + slots * self._stride
+        self._shm = shared_memory.SharedMemory(
+            name=name, create=create, size=size)
+        self.name = self._shm.name
+        self._buf = self._shm.buf
+        self._seq = 0
+        if create:
+            _HEADER.pack_into(self._buf, 0, 0)
+            for slot in range(slots):
+                _SLOT_HEADER.pack_into(self._buf, self._offset(slot), 0, 0)
+
+    def __reduce__(self):
+        # attach by name when sent to a spawned process
+        return (FrameRing, (self.name, self.slots, self.slot_size))
+
+    def _offset(self, slot):
+        return _HEADER.size + slot * self._stride
+
+    def put(self, data):
+        ''' Publish a payload, returns its sequence number or None if it does not fit '''
+        length = len(data)
+        if length > self.slot_size:
+            logger.warning(
+                f"dropping {length} bytes payload, slot size is {self.slot_size}")
+            return
+        seq = self._seq + 1
+        offset = self._offset(seq % self.slots)
+        start = offset + _SLOT_HEADER.size
+        # mark slot as being written before touching the payload
+        _SLOT_HEADER.pack_into(self._buf, offset, 0, length)
+        self._buf[start:start + length] = data
+        _SLOT_HEADER.pack_into(self._buf, offset, seq, length)
+        _HEADER.pack_into(self._buf, 0, seq)
+        self._seq = seq
+        return seq
+
+    def get_latest(self, seq=0, retries=3):
+        ''' Get (seq, payload) of the newest payload after seq, payload is None if nothing new '''
+        for _ in range(retries):
+            latest, = _HEADER.unpack_from(self._buf, 0)
+            if latest <= seq:
+                return seq, None
+            offset = self._offset(latest % self.slots)
+            start = offset + _SLOT_HEADER.size
+            slot_seq, length = _SLOT_HEADER.unpack_from(self._buf, offset)
+            if slot_seq != latest:
+                continue
+            data = bytes(self._buf[start:start + length])
+            slot_seq, _ = _SLOT_HEADER.unpack_from(self._buf, offset)
+            if slot_seq == latest:
+                return latest, data
+        return seq, None
+
+    def close(self):
+        self._buf = None
+        self._shm.close()
+
+    def unlink(self):
+        ''' Remove the shared memory block, mappings stay valid until closed '''
+        self._shm.unlink()
@@ -0,0 +1,108 @@
+import atexit
+import json
+import logging
+import os
+import sys
+import threading
+import cv2
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from lane_detection.run import LaneDetector, socket_frames
+logger = logging.getLogger(__name__)
+
+
+def _serialize(line):
+    if line is None:
+        return None
+    return [[int(x), int(y)] for x, y in line]
+
+
+class LaneOverlay(threading.Thread):
+    '''
+    Run the LaneDetector pipeline on the latest frames of a camera.
+    Each frame is processed once for every viewer, frames arriving while all
+    workers are busy are skipped so the live feed never waits on detection.
+    '''
+
+    def __init__(self, camera, workers=2, quality=80, scale=1.0, ring=None, lines_ring=None):
+        super(LaneOverlay, self).__init__(daemon=True)
+        self._camera = camera
+        self._workers = workers
+        self._quality = quality
+        self._scale = scale
+        self._latest = (0, None)
+        self._lines = (0, None)
+        # optional shared memory rings for worker processes
+        self._ring = ring
+        self._lines_ring = lines_ring
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        # the interpreter must not tear this thread down in the middle of a cv2 call
+        atexit.register(self.stop)
+        self.start()
+
+    def stop(self):
+        self._stopping.set()
+        self.join(timeout=1)
+
+    def run(self):
+        # camera frames are decoded once for every consumer, draw on a copy
+        frames = (frame.copy() for frame in
+                  socket_frames(self._camera, decoded=True, stop=self._stopping))
+        results = LaneDetector(scale=self._scale).pipeline(
+            frames, inplace=True, workers=self._workers, on_error=self._log_error)
+        try:
+            for _, (left_line, right_line), overlay in results:
+                if self._stopping.is_set():
+                    break
+                self._publish(overlay, left_line, right_line)
+        except RuntimeError:
+            # the interpreter is shutting down and the pool takes no more frames
+            pass
+        finally:
+            results.close()
+
+    def _log_error(self, frame, error):
+        logger.error(f"lane detection failed: {error}")
+
+    def _publish(self, overlay, left_line, right_line):
+        success, encoded = cv2.imencode(
+            '.jpg', overlay, [cv2.IMWRITE_JPEG_QUALITY, self._quality])
+        if not success:
+            return
+        lines = {'left': _serialize(left_line), 'right': _serialize(right_line)}
+        with self._lock:
+            self._latest = (self._latest[0] + 1, encoded.tobytes())
+            self._lines = (self._lines[0] + 1, lines)
+        if self._ring is not None:
+            self._ring.put(self._latest[1])
+        if self._lines_ring is not None:
+            self._lines_ring.put(json.dumps(lines).encode())
+
+    def get_latest(self, seq=0):
+        ''' Get (seq, frame) of the newest overlay after seq, frame is None if nothing new '''
+        with self._lock:
+            latest_seq, frame = self._latest
+        if latest_seq <= seq:
+            return seq, None
+        return latest_seq, frame
+
+    def get_lines(self, seq=0):
+        ''' Get (seq, lines) of the newest detected lines after seq, lines is None if nothing new '''
+        with self._lock:
+            latest_seq, lines = self._lines
+        if latest_seq <= seq:
+            return seq, None
+        return latest_seq, lines
+
+
+class LinesReader():
+    ''' Read lane lines published by a LaneOverlay in another process '''
+
+    def __init__(self, ring):
+        self._ring = ring
+
+    def get_lines(self, seq=0):
+        seq, message = self._ring.get_latest(seq)
+        if message is None:
+            return seq, None
+        return seq, json.loads(message.decode())
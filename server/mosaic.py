@@ -0,0 +1,86 @@
+import atexit
+import logging
+import math
+import threading
+import time
+import cv2
+import numpy as np
+logger = logging.getLogger(__name__)
+
+
+class Mosaic(threading.Thread):
+    '''
+    Tile the latest frame of every camera into a single JPEG.
+    The composite is built once per tick and shared by every viewer.
+    '''
+
+    def __init__(self, cameras, tile_size=(320, 240), fps=10, quality=80, ring=None):
+        super(Mosaic, self).__init__(daemon=True)
+        self._cameras = list(cameras)
+        self._tile_w, self._tile_h = tile_size
+        self._period = 1 / fps
+        self._quality = quality
+        self._cols = math.ceil(math.sqrt(len(self._cameras)))
+        self._rows = math.ceil(len(self._cameras) / self._cols)
+        # one preallocated tile per grid cell, unused cells stay black
+        self._tiles = np.zeros((self._rows * self._cols, self._tile_h, self._tile_w, 3),
+                               dtype=np.uint8)
+        self._seqs = [0] * len(self._cameras)
+        self._latest = (0, None)
+        # optional shared memory ring for worker processes
+        self._ring = ring
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        # the interpreter must not tear this thread down in the middle of a cv2 call
+        atexit.register(self.stop)
+        self.start()
+
+    def stop(self):
+        self._stopping.set()
+        self.join(timeout=1)
+
+    def run(self):
+        while not self._stopping.is_set():
+            started = time.monotonic()
+            if self._update_tiles():
+                success, encoded = cv2.imencode(
+                    '.jpg', self._compose(), [cv2.IMWRITE_JPEG_QUALITY, self._quality])
+                if success:
+                    self._publish(encoded.tobytes())
+            time.sleep(max(0, self._period - (time.monotonic() - started)))
+
+    def _update_tiles(self):
+        ''' Resize new decoded frames into their tile, returns whether any tile changed '''
+        changed = False
+        for idx, camera in enumerate(self._cameras):
+            seq, img = camera.get_decoded(self._seqs[idx])
+            if seq == self._seqs[idx]:
+                continue
+            self._seqs[idx] = seq
+            if img is None:
+                logger.debug(f"could not decode frame {seq} of camera {idx}")
+                continue
+            cv2.resize(img, (self._tile_w, self._tile_h), dst=self._tiles[idx])
+            changed = True
+        return changed
+
+    def _compose(self):
+        ''' (rows*cols, h, w, 3) tiles -> (rows*h, cols*w, 3) grid '''
+        grid = self._tiles.reshape(self._rows, self._cols,
+                                   self._tile_h, self._tile_w, 3)
+        return grid.swapaxes(1, 2).reshape(self._rows * self._tile_h,
+                                           self._cols * self._tile_w, 3)
+
+    def _publish(self, jpeg):
+        with self._lock:
+            self._latest = (self._latest[0] + 1, jpeg)
+        if self._ring is not None:
+            self._ring.put(jpeg)
+
+    def get_latest(self, seq=0):
+        ''' Get (seq, frame) of the newest mosaic after seq, frame is None if nothing new '''
+        with self._lock:
+            latest_seq, frame = self._latest
+        if latest_seq <= seq:
+            return seq, None
+        return latest_seq, frame
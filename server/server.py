@@ -1,83 +1,257 @@
-import traceback
-import aiohttp_cors
-import threading
 import asyncio
-import aiohttp
-from aiohttp import web, MultipartWriter
-import socketio
-from radar_socket import RadarSocket
-from camera_socket import CameraSocket
-from collections import deque
-import os
-import sys
 import logging
+import os
 import config
 logger = logging.getLogger(__name__)
 
-''' VARIABLES '''
-camera_socket = CameraSocket(addr=config.CAMERA['address'])
-radar_socket = RadarSocket(addr=config.RADARS['address'])
-
 ''' AIOHTTP '''
 
 
 async def index(request):
+    from aiohttp import web
     dirname = os.path.dirname(__file__)
     filename = os.path.join(dirname, './templates/index.html')
     return web.FileResponse(filename)
 
 
-async def camera_feed(request):
+async def _stream(request, source):
+    ''' Stream every new frame of source as MJPEG until the viewer leaves '''
+    from aiohttp import web, MultipartWriter
     response = web.StreamResponse(status=200, headers={
                                   'Content-Type': 'multipart/x-mixed-replace;boundary=--frame'})
 
     await response.prepare(request)
 
-    async with aiohttp.ClientSession() as client:
+    seq = 0
+    try:
         while True:
-            frame = camera_socket.get_frame()
+            seq, frame = source.get_latest(seq)
             if frame is not None:
                 with MultipartWriter('image/jpeg', boundary='frame') as mpwriter:
                     mpwriter.append(frame, {'Content-Type': 'image/jpeg'})
                     await mpwriter.write(response, close_boundary=False)
             # release event loop
             await asyncio.sleep(0.01)
+    except ConnectionResetError:
+        logger.debug("viewer disconnected")
 
     return response
 
 
-app = web.Application()
+async def camera_feed(request):
+    ''' First configured camera '''
+    cameras = request.app['cameras']
+    return await _stream(request, next(iter(cameras.values())))
+
+
+async def camera(request):
+    from aiohttp import web
+    source = request.app['cameras'].get(request.match_info['name'])
+    if source is None:
+        raise web.HTTPNotFound()
+    return await _stream(request, source)
+
+
+async def camera_mosaic(request):
+    from aiohttp import web
+    if request.app['mosaic'] is None:
+        raise web.HTTPNotFound()
+    return await _stream(request, request.app['mosaic'])
+
+
+async def camera_feed_lanes(request):
+    from aiohttp import web
+    if request.app['lanes'] is None:
+        raise web.HTTPNotFound()
+    return await _stream(request, request.app['lanes'])
 
-app.add_routes([web.get('/', index),
-                web.get('/camera_feed.mjpg', camera_feed)])
-# Cors all routes
-cors = aiohttp_cors.setup(app, defaults={
-    "*": aiohttp_cors.ResourceOptions(
-        allow_credentials=True,
-        expose_headers="*",
-        allow_headers="*",
-    )
-})
-for route in list(app.router.routes()):
-    cors.add(route)
 
 ''' SOCKET IO '''
-sio = socketio.AsyncServer(async_mode='aiohttp')
-sio.attach(app)
 
 
-async def emit_radar():
+async def emit_radar(app):
     logger.info("Starting radar emitting task...")
+    radar_socket = app['radar_socket']
+    sio = app['sio']
+    seq = 0
     while True:
-        value = radar_socket.get_value()
-        if not value:
-            continue
-        await sio.emit("new value", value, namespace="/radar")
+        seq, value = radar_socket.get_latest(seq)
+        if value is not None:
+            await sio.emit("new value", value, namespace="/radar")
         await asyncio.sleep(1)
 
 
+async def emit_lanes(app):
+    logger.info("Starting lanes emitting task...")
+    lane_lines = app['lane_lines']
+    sio = app['sio']
+    seq = 0
+    while True:
+        seq, lines = lane_lines.get_lines(seq)
+        if lines is not None:
+            await sio.emit("new lines", lines, namespace="/lanes")
+        await asyncio.sleep(0.1)
+
+
+async def start_background_tasks(app):
+    app['tasks'] = [asyncio.ensure_future(emit_radar(app))]
+    if app['lane_lines'] is not None:
+        app['tasks'].append(asyncio.ensure_future(emit_lanes(app)))
+
+
+async def cleanup_background_tasks(app):
+    for task in app['tasks']:
+        task.cancel()
+
+
+def _start_ingest(rings=None):
+    '''
+    Bind camera and radar sockets and start the derived streams.
+    Returns the app sources, each one also publishes into its ring of `rings` if any.
+    '''
+    from camera_socket import CameraSocket
+    from radar_socket import RadarSocket
+    rings = rings or {}
+    camera_rings = rings.get('cameras', {})
+    cameras = {name: CameraSocket(addr=camera['address'], ring=camera_rings.get(name))
+               for name, camera in config.CAMERAS.items()}
+    sources = {
+        'cameras': cameras,
+        'radar_socket': RadarSocket(addr=config.RADARS['address'], ring=rings.get('radar_socket')),
+        'mosaic': None,
+        'lanes': None,
+        'lane_lines': None
+    }
+    if len(cameras) > 1:
+        from mosaic import Mosaic
+        sources['mosaic'] = Mosaic(
+            cameras.values(), ring=rings.get('mosaic'), **config.MOSAIC)
+    if config.LANES['enabled']:
+        from lanes import LaneOverlay
+        lanes = LaneOverlay(cameras[config.LANES['camera']],
+                            workers=config.LANES['workers'],
+                            quality=config.LANES['quality'],
+                            scale=config.LANES['scale'],
+                            ring=rings.get('lanes'),
+                            lines_ring=rings.get('lane_lines'))
+        sources['lanes'] = sources['lane_lines'] = lanes
+    return sources
+
+
+def create_app(sources=None):
+    '''
+    Build the aiohttp application, heavy imports and socket binds happen here.
+    Worker processes pass readers over the shared frame rings instead of sockets.
+    '''
+    from aiohttp import web
+    import aiohttp_cors
+    import socketio
+
+    if sources is None:
+        sources = _start_ingest()
+
+    app = web.Application()
+    for key, source in sources.items():
+        app[key] = source
+
+    app.add_routes([web.get('/', index),
+                    web.get('/camera_feed.mjpg', camera_feed),
+                    web.get('/camera/{name}.mjpg', camera),
+                    web.get('/camera_mosaic.mjpg', camera_mosaic),
+                    web.get('/camera_feed_lanes.mjpg', camera_feed_lanes)])
+    # Cors all routes
+    cors = aiohttp_cors.setup(app, defaults={
+        "*": aiohttp_cors.ResourceOptions(
+            allow_credentials=True,
+            expose_headers="*",
+            allow_headers="*",
+        )
+    })
+    for route in list(app.router.routes()):
+        cors.add(route)
+
+    sio = socketio.AsyncServer(async_mode='aiohttp')
+    sio.attach(app)
+    app['sio'] = sio
+
+    app.on_startup.append(start_background_tasks)
+    app.on_cleanup.append(cleanup_background_tasks)
+    return app
+
+
+def _serve_worker(rings):
+    from aiohttp import web
+    from radar_socket import RadarReader
+    sources = {
+        'cameras': rings['cameras'],
+        'radar_socket': RadarReader(rings['radar_socket']),
+        'mosaic': rings['mosaic'],
+        'lanes': rings['lanes'],
+        'lane_lines': None
+    }
+    if rings['lane_lines'] is not None:
+        from lanes import LinesReader
+        sources['lane_lines'] = LinesReader(rings['lane_lines'])
+    app = create_app(sources)
+    # every worker listens on the same port, the kernel balances connections
+    web.run_app(app, host=config.SERVER['host'], port=config.SERVER['port'],
+                reuse_port=True, print=None)
+
+
+def start_multiprocess(workers):
+    ''' Ingest in this process, serve HTTP and socket.io from `workers` processes '''
+    import multiprocessing
+    import signal
+    import sys
+    from frame_ring import FrameRing
+    rings = {
+        'cameras': {name: FrameRing(create=True, **config.FRAME_RING)
+                    for name in config.CAMERAS},
+        'radar_socket': FrameRing(create=True, slots=64, slot_size=256),
+        'mosaic': None,
+        'lanes': None,
+        'lane_lines': None
+    }
+    if len(config.CAMERAS) > 1:
+        rings['mosaic'] = FrameRing(create=True, **config.FRAME_RING)
+    if config.LANES['enabled']:
+        rings['lanes'] = FrameRing(create=True, **config.FRAME_RING)
+        rings['lane_lines'] = FrameRing(create=True, slots=64, slot_size=1024)
+    shared = list(rings['cameras'].values()) + \
+        [ring for key, ring in rings.items() if key != 'cameras' and ring is not None]
+    # fork workers before any zmq context exists in this process
+    processes = [multiprocessing.Process(target=_serve_worker, args=(rings,), daemon=True)
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    logger.info(f"Started {workers} server workers")
+
+    # run the cleanup below on SIGTERM as well
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+
+    _start_ingest(rings)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.kill()
+        # ingest threads may still be writing, keep the mappings alive
+        for ring in shared:
+            ring.unlink()
+
+
 def start():
-    loop = asyncio.get_event_loop()
-    loop.create_task(emit_radar())
+    workers = config.SERVER['workers']
+    if workers > 1:
+        return start_multiprocess(workers)
+    from aiohttp import web
+    app = create_app()
     logger.info("Starting server...")
-    web.run_app(app)
+    web.run_app(app, host=config.SERVER['host'], port=config.SERVER['port'])